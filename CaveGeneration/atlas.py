@@ -0,0 +1,111 @@
+import json
+import math
+import os
+
+import numpy as np
+
+import terrain
+
+# All the textures packed into one image, rebuilt only when a texture file changes
+TEXTURE_DIR = "textures"
+ATLAS_PATH = os.path.join(TEXTURE_DIR, "atlas.png")
+INDEX_PATH = os.path.join(TEXTURE_DIR, "atlas.json")
+
+# Textures of the objects and monsters, by name
+OBJECT_FILES = {"CHEST": "chest.png", "BAG": "bag.png", "MONSTER": "monster.png"}
+
+# Size of the atlas cells, every texture fits into one
+CELL = 16
+
+
+def texture_files():
+    files = {tile: os.path.join(TEXTURE_DIR, "Tile_" + str(tile) + ".png") for tile in terrain.TILE_IDS}
+    files.update({name: os.path.join(TEXTURE_DIR, file) for name, file in OBJECT_FILES.items()})
+    return files
+
+
+def signature(files):
+    # The atlas is stale as soon as a texture file is replaced or changed
+    return [[str(name), path, os.stat(path).st_mtime_ns, os.stat(path).st_size] for name, path in files.items()]
+
+
+def read_rgba(surface):
+    """
+    Function that converts a surface into a RGBA array indexed as [y, x], with the colorkey pixels transparent
+    """
+
+    import pygame
+
+    width, height = surface.get_size()
+    rgba = np.frombuffer(pygame.image.tobytes(surface, "RGBA"), dtype=np.uint8).reshape(height, width, 4).copy()
+
+    colorkey = surface.get_colorkey()
+    if colorkey is not None:
+        rgba[(rgba[:, :, :3] == colorkey[:3]).all(axis=2), 3] = 0
+
+    return rgba
+
+
+def build(files):
+    """
+    Function that packs the textures into the atlas image and writes it with the index of their rectangles
+    """
+
+    import pygame
+
+    columns = math.ceil(math.sqrt(len(files)))
+    rows = math.ceil(len(files) / columns)
+    image = np.zeros((rows * CELL, columns * CELL, 4), dtype=np.uint8)
+
+    rects = {}
+    for n, (name, path) in enumerate(files.items()):
+        rgba = read_rgba(pygame.image.load(path))
+        height, width = rgba.shape[:2]
+        x, y = n % columns * CELL, n // columns * CELL
+        image[y:y + height, x:x + width] = rgba
+        rects[str(name)] = [x, y, width, height]
+
+    # Written aside and then moved, so processes building it at the same time never read half a file
+    surface = pygame.image.frombuffer(image.tobytes(), (columns * CELL, rows * CELL), "RGBA")
+    temporary = "." + str(os.getpid()) + ".tmp"
+    pygame.image.save(surface, ATLAS_PATH + temporary + ".png")
+    os.replace(ATLAS_PATH + temporary + ".png", ATLAS_PATH)
+    with open(INDEX_PATH + temporary, "w") as f:
+        json.dump({"signature": signature(files), "rects": rects}, f)
+    os.replace(INDEX_PATH + temporary, INDEX_PATH)
+
+    return rects
+
+
+def load():
+    """
+    Function that reads the atlas in one go, building it first if it is missing or stale.
+    Returns the atlas surface and the rectangle (x, y, width, height) of every texture, by tile id or object name
+    """
+
+    import pygame
+
+    files = texture_files()
+    rects = None
+    if os.path.exists(ATLAS_PATH) and os.path.exists(INDEX_PATH):
+        with open(INDEX_PATH) as f:
+            index = json.load(f)
+        if index["signature"] == signature(files):
+            rects = index["rects"]
+
+    if rects is None:
+        rects = build(files)
+
+    rects = {int(name) if name.isdigit() else name: rect for name, rect in rects.items()}
+    return pygame.image.load(ATLAS_PATH), rects
+
+
+def arrays():
+    """
+    Function that returns every texture as a RGBA array indexed as [y, x], for rendering without a display
+    """
+
+    surface, rects = load()
+    image = read_rgba(surface)
+
+    return {name: image[y:y + height, x:x + width] for name, (x, y, width, height) in rects.items()}
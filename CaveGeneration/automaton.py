@@ -0,0 +1,315 @@
+import numpy as np
+
+import rules
+
+
+def to_array(tiles, width: int, height: int):
+    """
+    Function that converts the flat tiles list (x + y * w) into a boolean grid indexed as [y, x]
+    """
+
+    return np.asarray(tiles, dtype=bool).reshape(height, width)
+
+
+def from_array(grid):
+    """
+    Function that converts a boolean grid back into the flat tiles list (x + y * w)
+    """
+
+    return grid.ravel().tolist()
+
+
+def integral_image(grid):
+    """
+    Function that builds the summed-area table of a boolean grid.
+    The table has a leading row and column of zeros, so table[y, x] is the number of True cells in grid[:y, :x]
+    """
+
+    height, width = grid.shape
+    table = np.zeros((height + 1, width + 1), dtype=np.int32)
+    np.cumsum(grid, axis=0, dtype=np.int32, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+
+    return table
+
+
+def area_count(table, x: int, y: int, radius: int, outside: bool = True):
+    """
+    Function that counts the True cells in the (2 * radius + 1)x(2 * radius + 1) area around (x, y) in O(1).
+    Out of bounds cells are counted when outside is True, like terrain.is_solid does for walls
+    """
+
+    height, width = table.shape[0] - 1, table.shape[1] - 1
+    x0, x1 = max(x - radius, 0), min(x + radius + 1, width)
+    y0, y1 = max(y - radius, 0), min(y + radius + 1, height)
+    if x0 >= x1 or y0 >= y1:
+        inside, area = 0, 0
+    else:
+        inside = int(table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0])
+        area = (x1 - x0) * (y1 - y0)
+
+    if outside:
+        # Add the cells of the area that fall out of the grid
+        return inside + (2 * radius + 1) ** 2 - area
+    return inside
+
+
+def count_walls(grid, radius: int, mode: str = "SAT"):
+    """
+    Function that counts the walls in the (2 * radius + 1)x(2 * radius + 1) area around every cell.
+    The cell itself is counted and out of bounds cells are treated as walls, like terrain.is_solid.
+    SAT mode reads four corners of a summed-area table per cell whatever the radius,
+    SHIFT mode sums 2 * (2 * radius + 1) shifted copies of the grid
+    """
+
+    return count_padded(np.pad(grid, radius, constant_values=True), radius, mode)
+
+
+def count_padded(padded, radius: int, mode: str = "SAT"):
+    """
+    Function that works like count_walls on a grid already padded by radius cells on every side,
+    e.g. a stripe of a larger grid with the rows around it. Returns the counts of the inner cells
+    """
+
+    height, width = padded.shape[0] - 2 * radius, padded.shape[1] - 2 * radius
+    size = 2 * radius + 1
+    padded = padded.view(np.uint8)
+
+    if mode == "SAT":
+        table = integral_image(padded)
+        return (table[size:, size:] - table[:height, size:]
+                - table[size:, :width] + table[:height, :width])
+
+    # Sum the shifted columns first, then the shifted rows
+    rows = np.zeros((height + 2 * radius, width), dtype=np.int32)
+    for dx in range(size):
+        rows += padded[:, dx:dx + width]
+
+    counts = np.zeros((height, width), dtype=np.int32)
+    for dy in range(size):
+        counts += rows[dy:dy + height]
+
+    return counts
+
+
+def count_kernel(padded, kernel):
+    """
+    Function that sums the weights of the kernel over the walls around every cell of a grid padded by the kernel
+    radius, one shifted copy of the grid for every cell of the kernel with some weight
+    """
+
+    radius = kernel.shape[0] // 2
+    height, width = padded.shape[0] - 2 * radius, padded.shape[1] - 2 * radius
+
+    counts = np.zeros((height, width), dtype=np.int64)
+    for dy, dx in zip(*np.nonzero(kernel)):
+        counts += kernel[dy, dx] * padded[dy:dy + height, dx:dx + width]
+
+    return counts
+
+
+def count_rule(padded, rule: rules.Rule, mode: str = "SAT"):
+    """
+    Function that counts the walls read by a compiled rule around every cell of a grid padded by the rule radius
+    """
+
+    if rule.box:
+        return count_padded(padded, rule.radius, mode)
+    return count_kernel(padded, rule.kernel)
+
+
+def step(grid, rule, mode: str = "SAT", border: bool = True):
+    """
+    Function that makes an iteraction for the whole grid at once, rule is anything rules.get_rule accepts.
+    Without border the margins are not forced to walls, for grids cut out of a larger world
+    """
+
+    rule = rules.get_rule(rule)
+    counts = count_rule(np.pad(grid, rule.radius, constant_values=True), rule, mode)
+    new_grid = rules.lookup(rule, grid, counts)
+    if not border:
+        return new_grid
+
+    # Ensure tiles at the margins remain walls
+    new_grid[0, :] = True
+    new_grid[-1, :] = True
+    new_grid[:, 0] = True
+    new_grid[:, -1] = True
+
+    return new_grid
+
+
+def count_lattice(padded, rule: rules.Rule, y0: int, x0: int, stride: int):
+    """
+    Function that counts the walls read by a compiled rule only around the cells [y0::stride, x0::stride] of a grid
+    padded by the rule radius, reading the padded grid with the same stride.
+    A box area is summed along the rows first (only at the columns of the sub-lattice) and then along the columns
+    (only at its rows), so a sub-lattice costs about (2 * radius + 1) / stride cells read for every cell of the grid
+    """
+
+    radius = rule.radius
+    size = 2 * radius + 1
+    height, width = padded.shape[0] - 2 * radius, padded.shape[1] - 2 * radius
+    rows, cols = len(range(y0, height, stride)), len(range(x0, width, stride))
+    # The smallest type holding the counts is the fastest to add
+    dtype = np.uint8 if rule.kernel.sum() < 256 else np.int64
+    padded = padded.view(np.uint8)
+
+    if not rule.box:
+        counts = np.zeros((rows, cols), dtype=dtype)
+        for dy, dx in zip(*np.nonzero(rule.kernel)):
+            counts += rule.kernel[dy, dx].astype(dtype) * padded[y0 + dy:y0 + dy + (rows - 1) * stride + 1:stride,
+                                                                 x0 + dx:x0 + dx + (cols - 1) * stride + 1:stride]
+        return counts
+
+    row_sums = np.zeros((height + 2 * radius, cols), dtype=dtype)
+    for dx in range(size):
+        row_sums += padded[:, x0 + dx:x0 + dx + (cols - 1) * stride + 1:stride]
+    counts = np.zeros((rows, cols), dtype=dtype)
+    for dy in range(size):
+        counts += row_sums[y0 + dy:y0 + dy + (rows - 1) * stride + 1:stride]
+
+    return counts
+
+
+def step_async(grid, rule, rng, schedule: str = "SUBLATTICE", border: bool = True):
+    """
+    Function that makes an asynchronous iteraction of the grid in place: the cells are updated one after the other
+    in random order, every one reading the current state of its neighbours, so a cell sees the cells updated before it.
+    CELLS schedule visits the cells one by one in a random permutation, keeping the wall counts up to date.
+    SUBLATTICE schedule splits the cells into the (radius + 1)^2 sub-lattices of cells radius + 1 apart on both axes:
+    no cell of a sub-lattice reads another one, so a whole sub-lattice is updated at once as an array operation,
+    and the sub-lattices are updated one after the other in random order.
+    rng is a numpy generator. Returns the flat indices of the cells that changed
+    """
+
+    height, width = grid.shape
+    rule = rules.get_rule(rule)
+    radius = rule.radius
+    padded = np.pad(grid, radius, constant_values=True)
+    old_grid = grid.copy()
+
+    if schedule == "CELLS":
+        counts = count_rule(padded, rule)
+        # A wall adds its weight to the count of every cell whose area it is in
+        spread = rule.kernel[::-1, ::-1]
+        for cell in rng.permutation(height * width).tolist():
+            y, x = divmod(cell, width)
+            if border and (x == 0 or y == 0 or x == width - 1 or y == height - 1):
+                continue
+            new_value = rule.table[int(grid[y, x]), counts[y, x]]
+            if new_value != grid[y, x]:
+                grid[y, x] = new_value
+                y0, y1 = max(y - radius, 0), min(y + radius + 1, height)
+                x0, x1 = max(x - radius, 0), min(x + radius + 1, width)
+                window = spread[y0 - y + radius:y1 - y + radius, x0 - x + radius:x1 - x + radius]
+                counts[y0:y1, x0:x1] += window if new_value else -window
+    else:
+        stride = radius + 1
+        inner = padded[radius:radius + height, radius:radius + width]
+        for lattice in rng.permutation(stride * stride).tolist():
+            y0, x0 = divmod(lattice, stride)
+
+            # Wall counts of the sub-lattice cells only, reading the current grid
+            counts = count_lattice(padded, rule, y0, x0, stride)
+            inner[y0::stride, x0::stride] = rules.lookup(rule, inner[y0::stride, x0::stride], counts)
+
+            if border:
+                # Tiles at the margins are never updated
+                inner[0, :], inner[-1, :] = old_grid[0, :], old_grid[-1, :]
+                inner[:, 0], inner[:, -1] = old_grid[:, 0], old_grid[:, -1]
+        grid[...] = inner
+
+    return np.flatnonzero(grid != old_grid)
+
+
+def hash_keys(size: int):
+    """
+    Function that draws a fixed random 64 bit key for every cell, used to hash generations
+    """
+
+    return np.random.default_rng(0).integers(np.iinfo(np.uint64).max, size=size, dtype=np.uint64)
+
+
+def grid_hash(keys, cells):
+    """
+    Function that hashes the walls of a generation, given as a boolean mask or as flat indices.
+    Hashes are xor of keys, so the hash of a generation is the hash of the previous one xor the changed cells
+    """
+
+    return int(np.bitwise_xor.reduce(keys[cells]))
+
+
+def around(cells, width: int, height: int, radius: int):
+    """
+    Function that returns the sorted flat indices (x + y * w) of the cells up to radius cells away from the given cells
+    """
+
+    ys, xs = np.divmod(np.asarray(cells, dtype=np.int64), width)
+    offsets = np.arange(-radius, radius + 1)
+    near_ys = ys[:, None, None] + offsets[None, :, None]
+    near_xs = xs[:, None, None] + offsets[None, None, :]
+    inside = (near_ys >= 0) & (near_ys < height) & (near_xs >= 0) & (near_xs < width)
+
+    return np.unique((near_xs + near_ys * width)[inside])
+
+
+def count_cells(grid, cells, kernel):
+    """
+    Function that works like count_kernel, but only for the given flat indices (x + y * w)
+    """
+
+    height, width = grid.shape
+    radius = kernel.shape[0] // 2
+    ys, xs = np.divmod(cells, width)
+
+    # Count the walls around every cell, out of bounds cells are walls
+    counts = np.zeros(len(cells), dtype=np.int64)
+    for dy, dx in zip(*np.nonzero(kernel)):
+        near_ys, near_xs = ys + dy - radius, xs + dx - radius
+        inside = (near_ys >= 0) & (near_ys < height) & (near_xs >= 0) & (near_xs < width)
+        walls = grid[np.clip(near_ys, 0, height - 1), np.clip(near_xs, 0, width - 1)] | ~inside
+        counts += kernel[dy, dx] * walls
+
+    return counts
+
+
+def step_cells(grid, cells, rule):
+    """
+    Function that makes an iteraction of the grid in place, only computing the given cells (flat indices).
+    Returns the flat indices of the cells that changed
+    """
+
+    rule = rules.get_rule(rule)
+    flat = grid.reshape(-1)
+    new_values = rules.lookup(rule, flat[cells], count_cells(grid, cells, rule.kernel))
+    changed = new_values != flat[cells]
+    flat[cells[changed]] = new_values[changed]
+
+    return cells[changed]
+
+
+def step_frontier(grid, changed, rule, mode: str = "SAT"):
+    """
+    Function that makes an iteraction of the grid in place, only computing the cells that can change:
+    the ones up to the rule radius away from the cells changed by the previous iteraction (None = every cell).
+    Returns the flat indices of the cells changed by this iteraction
+    """
+
+    height, width = grid.shape
+    radius = rules.get_rule(rule).radius
+
+    # With many changes a whole grid step is cheaper
+    if changed is None or len(changed) * (2 * radius + 1) ** 2 >= grid.size:
+        new_grid = step(grid, rule, mode)
+        changed = np.flatnonzero(new_grid != grid)
+        grid[...] = new_grid
+        return changed
+
+    cells = around(changed, width, height, radius)
+
+    # Tiles at the margins always remain walls
+    ys, xs = np.divmod(cells, width)
+    cells = cells[(xs > 0) & (xs < width - 1) & (ys > 0) & (ys < height - 1)]
+
+    return step_cells(grid, cells, rule)
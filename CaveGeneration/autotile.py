@@ -0,0 +1,136 @@
+import numpy as np
+
+import automaton
+import rules
+from config import *
+
+# Bits of the mask of the walls connected to a wall
+LEFT, RIGHT, UP, DOWN = 1, 2, 4, 8
+
+# Textures for every mask of connected walls, one of them is picked at random.
+# None leaves the wall as it is (ISOLATED), L+U+R uses CON_URD like the old set_wall_type did
+WALL_TABLE = {
+    0: None,
+    LEFT: L_LIST,
+    RIGHT: R_LIST,
+    UP: U_LIST,
+    DOWN: D_LIST,
+    LEFT | RIGHT: LR_LIST,
+    UP | DOWN: UD_LIST,
+    LEFT | UP: [CON_UL],
+    LEFT | DOWN: [CON_DL],
+    RIGHT | DOWN: [CON_DR],
+    RIGHT | UP: [CON_UR],
+    LEFT | RIGHT | UP: [CON_URD],
+    LEFT | RIGHT | DOWN: [CON_LDR],
+    UP | RIGHT | DOWN: [CON_URD],
+    UP | LEFT | DOWN: [CON_LUD],
+    LEFT | RIGHT | UP | DOWN: [CON_LURD],
+}
+
+GROUND_TILES = [GROUND, GROUND_STONE, GROUND_BONES]
+NOT_WALL_TILES = [VOID] + GROUND_TILES
+
+# WALL_TABLE as arrays: the textures of every mask padded to the same length and how many there are
+VARIANTS = np.array([len(WALL_TABLE[mask] or []) for mask in range(16)])
+TEXTURES = np.zeros((16, VARIANTS.max()), dtype=np.int32)
+for mask in range(16):
+    TEXTURES[mask, :VARIANTS[mask]] = WALL_TABLE[mask] or []
+
+
+def is_wall(tile_ids):
+    return ~np.isin(tile_ids, NOT_WALL_TILES)
+
+
+def is_ground(tile_ids):
+    return np.isin(tile_ids, GROUND_TILES)
+
+
+def base_tiles(walls, counts, rng):
+    """
+    Function that chooses the tiles before connecting the walls: VOID for walls surrounded by 9 walls,
+    ISOLATED for the other walls and a random ground texture for the rest
+    """
+
+    stone = rng.random(walls.shape) < 0.05
+    bones = rng.random(walls.shape) < 0.5
+    ground = np.where(stone, np.where(bones, GROUND_STONE, GROUND_BONES), GROUND)
+
+    return np.where(walls, np.where(counts == 9, VOID, ISOLATED), ground).astype(np.int32)
+
+
+def pick_textures(masks, rng):
+    # One random variant for every mask, all at once
+    variants = (rng.random(masks.shape) * VARIANTS[masks]).astype(np.int64)
+    return TEXTURES[masks, variants]
+
+
+def connect_walls(tile_grid, rng):
+    """
+    Function that gives every wall of a tile grid indexed as [y, x] the texture connecting it to the walls
+    at its left, right, up and down. Out of bounds cells are not walls
+    """
+
+    walls = np.pad(is_wall(tile_grid), 1, constant_values=False)
+    masks = (walls[1:-1, :-2] * LEFT | walls[1:-1, 2:] * RIGHT |
+             walls[:-2, 1:-1] * UP | walls[2:, 1:-1] * DOWN)
+
+    return np.where(walls[1:-1, 1:-1] & (masks != 0), pick_textures(masks, rng), tile_grid)
+
+
+def connect_cells(tile_grid, cells, rng):
+    """
+    Function that works like connect_walls, but only for the given flat indices (x + y * w).
+    Returns the new tiles of those cells
+    """
+
+    height, width = tile_grid.shape
+    flat = tile_grid.reshape(-1)
+    ys, xs = np.divmod(cells, width)
+
+    masks = np.zeros(len(cells), dtype=np.int64)
+    for bit, dx, dy in ((LEFT, -1, 0), (RIGHT, 1, 0), (UP, 0, -1), (DOWN, 0, 1)):
+        near_xs, near_ys = xs + dx, ys + dy
+        inside = (near_xs >= 0) & (near_xs < width) & (near_ys >= 0) & (near_ys < height)
+        near = np.clip(near_xs, 0, width - 1) + np.clip(near_ys, 0, height - 1) * width
+        masks |= np.where(inside & is_wall(flat[near]), bit, 0)
+
+    tiles = flat[cells]
+    return np.where(is_wall(tiles) & (masks != 0), pick_textures(masks, rng), tiles)
+
+
+def build_tile_map(walls, rng, mode: str = "SAT"):
+    """
+    Function that builds the flat tile map (x + y * w) of a boolean grid of walls indexed as [y, x].
+    The margins are always walls or VOID
+    """
+
+    counts = automaton.count_walls(walls, 1, mode)
+
+    walls = walls.copy()
+    walls[0, :] = walls[-1, :] = walls[:, 0] = walls[:, -1] = True
+
+    tile_grid = base_tiles(walls, counts, rng)
+    return connect_walls(tile_grid, rng).reshape(-1)
+
+
+def update_tile_map(tile_map, walls, cells, rng):
+    """
+    Function that rebuilds in place the flat tile map only around the changed cells (flat indices),
+    keeping the ground textures of the others
+    """
+
+    height, width = walls.shape
+
+    # A changed cell can turn its neighbours into VOID or back into walls
+    near = automaton.around(cells, width, height, 1)
+    ys, xs = np.divmod(near, width)
+    near_walls = walls.reshape(-1)[near] | (xs == 0) | (xs == width - 1) | (ys == 0) | (ys == height - 1)
+    new_tiles = base_tiles(near_walls, automaton.count_cells(walls, near, rules.moore(1, True)), rng)
+    old_tiles = tile_map[near]
+    tile_map[near] = np.where(~near_walls & is_ground(old_tiles), old_tiles, new_tiles)
+
+    # And change the walls connected to those neighbours
+    near = automaton.around(cells, width, height, 2)
+    tile_map[near[is_wall(tile_map[near])]] = ISOLATED
+    tile_map[near] = connect_cells(tile_map.reshape(height, width), near, rng)
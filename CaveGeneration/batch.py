@@ -0,0 +1,87 @@
+import argparse
+import multiprocessing
+import os
+import random
+
+import export
+import monsters
+import objects
+import render
+import terrain
+from config import *
+
+
+def generate_map(seed: int, iterations: int, output: str, binary: bool = False, encoding: str = JSON_ENCODING,
+                 preview=None, levels: int = LEVELS):
+    """
+    Function that builds a whole map without a display and writes it into the output directory,
+    with a PNG preview of preview pixels per cell if preview is set.
+    The automata stops after iterations iteractions or as soon as it is stable (with more than one level the walls
+    are generated coarse to fine instead, see multires.py), then the caves are cleaned with MIN_REGION_SIZE
+    and CONNECT_REGIONS. The same seed always builds the same map
+    """
+
+    random.seed(seed)
+
+    # The tile map is built only once, when the walls are final
+    if levels > 1:
+        terrain.setup_levels(levels, tile=False)
+    else:
+        terrain.setup(tile=False)
+        terrain.run_until_stable(iterations)
+    terrain.clean_regions()
+
+    terrain.to_tile_set()
+    chest_grid = objects.place_chests()
+    monsters.place_monsters(chest_grid)
+
+    if binary:
+        path = os.path.join(output, "map_" + str(seed) + ".cave")
+        export.save_grid_to_binary(path, seed)
+    else:
+        path = os.path.join(output, "map_" + str(seed) + ".json")
+        export.stream_grid_to_json(path, encoding)
+
+    if preview:
+        render.save_preview(os.path.join(output, "map_" + str(seed) + ".png"), preview)
+
+    return path
+
+
+def generate_maps(count: int, seed: int, iterations: int, output: str, workers=None, binary: bool = False,
+                  encoding: str = JSON_ENCODING, preview=None, levels: int = LEVELS):
+    """
+    Function that builds count maps over a pool of processes, map n uses the seed seed + n
+    """
+
+    os.makedirs(output, exist_ok=True)
+    jobs = [(seed + n, iterations, output, binary, encoding, preview, levels) for n in range(count)]
+
+    with multiprocessing.Pool(workers) as pool:
+        return pool.starmap(generate_map, jobs)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate cave maps without opening a window")
+    parser.add_argument("-n", "--count", type=int, default=1, help="number of maps to generate")
+    parser.add_argument("-k", "--iterations", type=int, default=5,
+                        help="maximum iteractions of the automata for every map")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the first map, map n uses seed + n")
+    parser.add_argument("-o", "--output", default="output/batch", help="directory where the maps are written")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("-b", "--binary", action="store_true", help="write compact binary maps instead of JSON")
+    parser.add_argument("-e", "--encoding", default=JSON_ENCODING, choices=["TILES", "RLE", "CSV"],
+                        help="encoding of the tile layers of the JSON maps")
+    parser.add_argument("-p", "--preview", type=int, default=None, metavar="SCALE",
+                        help="also write a PNG preview with SCALE pixels per cell (1 for thumbnails)")
+    parser.add_argument("-l", "--levels", type=int, default=LEVELS,
+                        help="levels of the coarse-to-fine generation, for large maps (1 = full size only)")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    paths = generate_maps(args.count, args.seed, args.iterations, args.output, args.workers, args.binary,
+                          args.encoding, args.preview, args.levels)
+    print("Generated " + str(len(paths)) + " maps into " + args.output)
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import export
+import main
+import monsters
+import objects
+import render
+import terrain
+from config import *
+
+# Modules reading the map size, the rule and the update mode from config
+MODULES = [terrain, objects, monsters, main, export, render]
+
+SIZES = [50, 200, 500, 1000, 2000]
+RULES = [1, 2, 3, 4, 5, 6, 7, 8]
+UPDATE_MODES = ["LINEAR", "RANDOM"]
+
+
+def configure(size: int, rule, update_mode: str):
+    """
+    Function that sets the map size, the rule and the update mode of every module, like editing config.py would
+    """
+
+    for module in MODULES:
+        module.w = module.h = size
+        module.RULE = rule
+        module.UPDATE_MODE = update_mode
+    objects.RADIUS = int(size / 10)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def run_case(size: int, rule, update_mode: str, seed: int, iterations: int, output: str):
+    """
+    Function that builds one map through every stage of the pipeline, returning the seconds spent in each stage.
+    The iteractions report the mean of the iterations steps
+    """
+
+    configure(size, rule, update_mode)
+    random.seed(seed)
+    times = {}
+
+    times["main.setup"], _ = timed(main.setup)
+
+    iterate = terrain.iterate_tiles_randomly if update_mode == "RANDOM" else terrain.iterate_tiles
+    steps = [timed(iterate)[0] for _ in range(iterations)]
+    times["terrain." + iterate.__name__] = statistics.mean(steps)
+
+    times["terrain.to_tile_set"], _ = timed(terrain.to_tile_set)
+    times["terrain.update_sprites"], _ = timed(terrain.update_sprites)
+    times["objects.place_chests"], chest_grid = timed(objects.place_chests)
+    times["monsters.place_monsters"], _ = timed(monsters.place_monsters, chest_grid)
+    times["main.save_grid_to_json"], _ = timed(main.save_grid_to_json, os.path.join(output, "map.json"))
+    times["render.render_map"], _ = timed(render.render_map, max(GRID_WIDTH // size, 1))
+
+    return times
+
+
+def run_benchmarks(sizes, rules, update_modes, seed: int = 0, iterations: int = 3, repeats: int = 3):
+    """
+    Function that runs every combination of sizes, rules and update modes repeats times with the same seed,
+    keeping the median time of every stage
+    """
+
+    results = []
+    with tempfile.TemporaryDirectory() as output:
+        for size in sizes:
+            for rule in rules:
+                for update_mode in update_modes:
+                    runs = [run_case(size, rule, update_mode, seed, iterations, output) for _ in range(repeats)]
+                    for stage in runs[0]:
+                        seconds = [run[stage] for run in runs]
+                        results.append({"size": size, "rule": rule, "update_mode": update_mode, "stage": stage,
+                                        "seconds": statistics.median(seconds), "min": min(seconds)})
+                        print("{:>5}  rule {}  {:<6}  {:<32} {:10.6f} s".format(size, rule, update_mode, stage,
+                                                                                results[-1]["seconds"]))
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "engine": ENGINE,
+            "count_mode": COUNT_MODE,
+            "seed": seed,
+            "iterations": iterations,
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold: float = 0.1):
+    """
+    Function that compares the results with a baseline run, printing the ratio of every stage found in both.
+    The fastest runs are compared, they are the least noisy.
+    Returns the stages slower than the baseline by more than threshold (0.1 = 10%)
+    """
+
+    def key(result):
+        return result["size"], result["rule"], result["update_mode"], result["stage"]
+
+    old = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        if key(result) not in old:
+            continue
+
+        ratio = result["min"] / max(old[key(result)]["min"], 1e-9)
+        slower = ratio > 1 + threshold
+        if slower:
+            regressions.append(dict(result, baseline=old[key(result)]["min"], ratio=ratio))
+        print("{:>5}  rule {}  {:<6}  {:<32} {:10.6f} s -> {:10.6f} s  x{:.2f}{}".format(
+            *key(result), old[key(result)]["min"], result["min"], ratio, "  SLOWER" if slower else ""))
+
+    return regressions
+
+
+def rule_arg(text: str):
+    # Preset numbers stay numbers, so the results compare with the older ones
+    return int(text) if text.isdigit() else text
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time every stage of the map generation")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="side of the square maps")
+    parser.add_argument("--rules", type=rule_arg, nargs="+", default=RULES,
+                        help="rules of the automata, preset numbers or birth/survival notations")
+    parser.add_argument("--modes", nargs="+", default=UPDATE_MODES, choices=UPDATE_MODES, help="update modes")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="seed of every map")
+    parser.add_argument("-k", "--iterations", type=int, default=3, help="iteractions timed for every map")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="runs of every case, the median is kept")
+    parser.add_argument("-o", "--output", default="output/benchmark.json", help="JSON file with the results")
+    parser.add_argument("-c", "--compare", default=None, metavar="BASELINE",
+                        help="JSON file of a previous run to compare with")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1,
+                        help="slowdown over the baseline reported as a regression (0.1 = 10%%)")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_benchmarks(args.sizes, args.rules, args.modes, args.seed, args.iterations, args.repeats)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Saved results to " + args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        print(str(len(regressions)) + " stages slower than the baseline")
+        sys.exit(1 if regressions else 0)
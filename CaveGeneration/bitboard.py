@@ -0,0 +1,214 @@
+import numpy as np
+
+import automaton
+import rules
+
+# Cells stored in every word of a row, bit k of word m is the cell x = m * WORD + k
+WORD = 64
+
+ONE = np.uint64(1)
+TOP = np.uint64(WORD - 1)
+FULL = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+# Words of the board stepped at once
+BLOCK_WORDS = 1 << 14
+
+
+def words_per_row(width: int):
+    return (width + WORD - 1) // WORD
+
+
+def from_array(grid):
+    """
+    Function that packs a boolean grid indexed as [y, x] into a board of shape (height, words per row)
+    """
+
+    height, width = grid.shape
+    padded = np.zeros((height, words_per_row(width) * WORD), dtype=bool)
+    padded[:, :width] = grid
+
+    return np.packbits(padded, axis=1, bitorder="little").view("<u8")
+
+
+def to_array(board, width: int):
+    """
+    Function that unpacks a board into a boolean grid indexed as [y, x]
+    """
+
+    bits = np.unpackbits(board.view(np.uint8), axis=1, bitorder="little")
+
+    return bits[:, :width].astype(bool)
+
+
+def pack(tiles, width: int, height: int):
+    """
+    Function that packs the flat tiles list (x + y * w) into a board
+    """
+
+    return from_array(automaton.to_array(tiles, width, height))
+
+
+def unpack(board, width: int):
+    """
+    Function that unpacks a board into the flat tiles list (x + y * w)
+    """
+
+    return automaton.from_array(to_array(board, width))
+
+
+def padding_mask(width: int):
+    # Bits of the last word of a row that are past the right margin
+    used = width % WORD
+    if used == 0:
+        return np.uint64(0)
+    return FULL ^ ((ONE << np.uint64(used)) - ONE)
+
+
+def wall_count(board):
+    return int(np.unpackbits(board.view(np.uint8)).sum())
+
+
+def full_add(a, b, c, total=None, carry=None, temp=None):
+    """
+    Function that adds three bit planes, returning the sum and the carry planes.
+    They are written into total and carry when given, temp is a plane to use for the partial sum
+    """
+
+    if total is None:
+        half = a ^ b
+        return half ^ c, (a & b) | (half & c)
+
+    half = np.bitwise_xor(a, b, out=temp)
+    np.bitwise_and(a, b, out=carry)
+    np.bitwise_xor(half, c, out=total)
+    half &= c
+    carry |= half
+    return total, carry
+
+
+def new_buffers(rows: int, words: int):
+    """
+    Function that allocates the planes used to step blocks of at most rows rows, reused by every block
+    """
+
+    # 6 planes with a halo row above and below the block, then 11 planes of the block rows
+    return [np.empty((rows + 2, words), dtype=np.uint64) for _ in range(6)] + \
+           [np.empty((rows, words), dtype=np.uint64) for _ in range(11)]
+
+
+def count_planes(board, width: int, y0: int = 0, y1=None, buffers=None):
+    """
+    Function that counts the walls in the 3x3 area around the cells of the rows y0 to y1 (all of them by default),
+    the cell itself included. The count (0 to 9) is returned as four bit planes, out of bounds cells are treated
+    as walls. The planes are written into buffers (see new_buffers), so counting a block allocates nothing
+    """
+
+    height, words = board.shape
+    y1 = height if y1 is None else y1
+    size = y1 - y0
+    if buffers is None:
+        buffers = new_buffers(size, words)
+    rows, west, east, h0, h1, half = (buffer[:size + 2] for buffer in buffers[:6])
+    s0, s1, s2, s3, temp = (buffer[:size] for buffer in buffers[6:11])
+
+    # The block with the row above and the row below, a row out of the grid is all walls
+    rows[0] = board[y0 - 1] if y0 > 0 else FULL
+    rows[1:-1] = board[y0:y1]
+    rows[-1] = board[y1] if y1 < height else FULL
+    # Out of bounds cells on the right are read from the padding bits, so set them
+    pad = padding_mask(width)
+    rows[:, -1] |= pad
+
+    # Left neighbour, the bit of cell x - 1 moved to x
+    np.left_shift(rows, ONE, out=west)
+    np.right_shift(rows[:, :-1], TOP, out=h0[:, 1:])
+    west[:, 1:] |= h0[:, 1:]
+    west[:, 0] |= ONE
+
+    # Right neighbour, the bit of cell x + 1 moved to x
+    np.right_shift(rows, ONE, out=east)
+    np.left_shift(rows[:, 1:], TOP, out=h0[:, :-1])
+    east[:, :-1] |= h0[:, :-1]
+    if pad == 0:
+        east[:, -1] |= ONE << TOP
+
+    # Sum of the three cells of every row (0 to 3)
+    full_add(west, rows, east, h0, h1, half)
+
+    # Add the three row sums, the rows above and below are the same planes moved by one row
+    carry0, carry1 = west[:size], east[:size]
+    full_add(h0[:-2], h0[1:-1], h0[2:], s0, carry0, temp)
+    full_add(h1[:-2], h1[1:-1], h1[2:], s2, carry1, temp)
+    np.bitwise_xor(s2, carry0, out=s1)
+    np.bitwise_and(s2, carry0, out=temp)
+    np.bitwise_xor(carry1, temp, out=s2)
+    np.bitwise_and(carry1, temp, out=s3)
+
+    return s0, s1, s2, s3
+
+
+def step(board, width: int, rule, out=None):
+    """
+    Function that makes an iteraction for the whole board, 64 cells for every word operation.
+    The board is stepped in blocks of rows sharing the same few planes, so besides the new board (written into out
+    when given) a step takes about 17 * BLOCK_WORDS words however large the board is.
+    Only the rules reading the whole 3x3 area are supported
+    """
+
+    compiled = rules.get_rule(rule)
+    if compiled.radius != 1 or not compiled.box:
+        raise ValueError("Rule " + str(rule) + " reads another area than the 3x3 one of the bitboard engine")
+
+    height, words = board.shape
+    new_board = np.empty_like(board) if out is None else out
+    block = max(1, min(height, BLOCK_WORDS // words))
+    buffers = new_buffers(block, words)
+
+    for y0 in range(0, height, block):
+        y1 = min(y0 + block, height)
+        size = y1 - y0
+        planes = count_planes(board, width, y0, y1, buffers)
+        inverse = [buffer[:size] for buffer in buffers[11:15]]
+        for plane, inverted in zip(planes, inverse):
+            np.invert(plane, out=inverted)
+        cells, match = buffers[15][:size], buffers[16][:size]
+        new_rows = new_board[y0:y1]
+        new_rows[:] = 0
+
+        # Keep the cells whose state and count make them solid
+        for state in (False, True):
+            if state:
+                cells[:] = board[y0:y1]
+            else:
+                np.invert(board[y0:y1], out=cells)
+            for count in np.flatnonzero(compiled.table[int(state)]):
+                match[:] = cells
+                for bit in range(4):
+                    match &= planes[bit] if (count >> bit) & 1 else inverse[bit]
+                new_rows |= match
+
+    # Ensure tiles at the margins remain walls
+    last_word, last_bit = divmod(width - 1, WORD)
+    new_board[0, :] = FULL
+    new_board[-1, :] = FULL
+    new_board[:, 0] |= ONE
+    new_board[:, last_word] |= ONE << np.uint64(last_bit)
+
+    # Keep the padding bits clear
+    new_board[:, -1] &= ~padding_mask(width)
+
+    return new_board
+
+
+def changed_cells(board, new_board, width: int):
+    """
+    Function that returns the flat indices (x + y * w) of the cells that differ between two boards, unpacking only
+    the words that changed
+    """
+
+    rows, columns = np.nonzero(board != new_board)
+    diff = board[rows, columns] ^ new_board[rows, columns]
+    bits = np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    words, offsets = np.nonzero(bits)
+
+    return rows[words] * width + columns[words] * WORD + offsets
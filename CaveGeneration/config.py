@@ -7,14 +7,48 @@ INITIAL_PROB = 0.45  # Initial probability to spawn a wall
 DEPTH = False  # Show the previous map, emulating depth
 
 # Iteraction parameters
-RULE = 1
-UPDATE_MODE = "LINEAR"  # LINEAR = sequential update, RANDOM = Randomly update all cells
+RULE = 1  # Preset 1 to 8 (see rules.py) or a birth/survival notation, e.g. "B5678/S45678"
+UPDATE_MODE = "LINEAR"  # LINEAR = sequential update, RANDOM = update the cells in place in random order
+ASYNC_SCHEDULE = "SUBLATTICE"  # Order of the RANDOM updates, SUBLATTICE = update sub-lattices of cells that do not
+# read each other as arrays, in random order, CELLS = update cell by cell in a random permutation
+ENGINE = "NUMPY"  # NUMPY = update the whole grid as an array, BITBOARD = 1 bit per cell (3x3 rules only),
+# INCREMENTAL = update only the cells near the last changes, PARALLEL = update stripes of the grid on every core,
+# PYTHON = update cell by cell
+WORKERS = None  # Processes of the PARALLEL engine, None = one per core
+CYCLE_WINDOW = 8  # Previous generations compared to detect cycles
+COUNT_MODE = "SAT"  # SAT = count walls with a summed-area table, SHIFT = sum shifted copies of the grid
+
+# Region parameters, applied once the automata is stable
+MIN_REGION_SIZE = 0  # Caves with fewer cells are filled with walls, 0 = keep all of them
+CONNECT_REGIONS = False  # Carve the shortest corridors joining all the caves
+
+# Export parameters
+JSON_ENCODING = "TILES"  # TILES = one entry per tile, RLE = runs of the same tile per row, CSV = one string per row
+
+# Stats parameters
+STATS = False  # Record the time, cells touched and memory of every phase of main.py, the S key toggles the overlay
+STATS_MEMORY = False  # Also trace the memory allocated by every phase, much slower
+
+# Distance fields parameters
+DISTANCE_CACHE = 16  # Distance fields kept by distances.DistanceFields
+
+# Multi-resolution parameters, for large maps
+LEVELS = 1  # Levels of the coarse-to-fine generation, every one half the size of the next, 1 = full size only
+COARSE_ITERATIONS = 8  # Maximum iteractions of the coarsest level
+REFINE_ITERATIONS = 2  # Maximum iteractions of every finer level
+REFINE_NOISE = 0.2  # Probability that a cell on the edges of the caves is drawn again after upsampling
+
+# Chunked world parameters
+CHUNK_SIZE = 64  # Number of cells on each side of a chunk
+CHUNK_ITERATIONS = 4  # Iteractions of the automata for every chunk
+CHUNK_CACHE_MB = 64  # Memory cap of the generated chunks
 
 # Object Parameters
 # RADIUS = 7
 RADIUS = int(w / 10)  # Radius for chest to spawn
 CHEST_PROB = 0.1  # Probability for chest to spawn
 BAG_PROB = 0.45  # Probability for bags to spawn
+CHEST_CLEARANCE = 2  # Free cells needed between a chest and the walls, looking left, right, up and down
 
 # Monsters Parameters
 MAX_MONSTERS = 3
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+
+import numpy as np
+
+import autotile
+import monsters
+import objects
+import terrain
+from config import *
+
+
+def distance_fields(walkable, width: int, source_sets):
+    """
+    Function that runs one breadth-first search for every set of sources (flat indices x + y * w) over the walkable
+    cells, moving left, right, up and down. All the searches advance together, one frontier of (search, cell) pairs
+    per step, so every field costs O(cells).
+    Returns an array with a row for every set: the distance to the nearest source, -1 where it cannot be reached
+    """
+
+    walkable = np.asarray(walkable, dtype=bool).reshape(-1)
+    size = len(walkable)
+    height = size // width
+    fields = np.full((len(source_sets), size), -1, dtype=np.int32)
+    flat_fields = fields.reshape(-1)
+
+    # Frontier as indices into the flattened fields, search * size + cell
+    frontier = np.unique(np.concatenate([np.asarray(list(sources), dtype=np.int64) + n * size
+                                         for n, sources in enumerate(source_sets)] + [np.zeros(0, dtype=np.int64)]))
+    frontier = frontier[walkable[frontier % size]]
+    flat_fields[frontier] = 0
+
+    # Last position of every cell in the list of reached cells, to drop the duplicates without sorting
+    slot = np.zeros(len(flat_fields), dtype=np.int64)
+
+    distance = 0
+    while len(frontier):
+        distance += 1
+        ys, xs = np.divmod(frontier % size, width)
+        steps = []
+        for dx, dy, inside in ((-1, 0, xs > 0), (1, 0, xs < width - 1), (0, -1, ys > 0), (0, 1, ys < height - 1)):
+            steps.append(frontier[inside] + dx + dy * width)
+
+        near = np.concatenate(steps)
+        near = near[walkable[near % size] & (flat_fields[near] < 0)]
+        slot[near] = np.arange(len(near))
+        frontier = near[slot[near] == np.arange(len(near))]
+        flat_fields[frontier] = distance
+
+    return fields
+
+
+def loot_mask(field, min_distance: int, max_distance=None):
+    """
+    Function that returns the cells of a distance field between min_distance and max_distance (included) away from
+    its sources, e.g. the cells where chests can be placed to be reachable and far enough from the spawn point
+    """
+
+    mask = field >= min_distance
+    if max_distance is not None:
+        mask &= field <= max_distance
+
+    return mask
+
+
+class DistanceFields:
+    """
+    Distance fields over the floor of terrain.tile_map, cached by set of sources.
+    The cache is emptied whenever the map changes (terrain.map_version), and keeps the cache_size fields used last
+    """
+
+    def __init__(self, cache_size: int = DISTANCE_CACHE):
+        self.cache_size = cache_size
+        self.fields = OrderedDict()
+        self.version = None
+
+    def walkable(self):
+        return autotile.is_ground(np.asarray(terrain.tile_map))
+
+    def check_version(self):
+        # Fields of an older map are no longer valid
+        if self.version != terrain.map_version:
+            self.fields.clear()
+            self.version = terrain.map_version
+
+    def get_fields(self, source_sets):
+        """
+        Function that returns the fields of every set of sources, computing all the missing ones in one batch
+        """
+
+        self.check_version()
+        keys = [tuple(sorted(set(sources))) for sources in source_sets]
+
+        missing = list(OrderedDict.fromkeys(key for key in keys if key not in self.fields))
+        if missing:
+            for key, field in zip(missing, distance_fields(self.walkable(), w, missing)):
+                self.fields[key] = field
+
+        result = []
+        for key in keys:
+            self.fields.move_to_end(key)
+            result.append(self.fields[key])
+
+        # Drop the least recently used fields, keeping the ones just asked for
+        while len(self.fields) > max(self.cache_size, len(set(keys))):
+            self.fields.popitem(last=False)
+
+        return result
+
+    def field(self, sources):
+        return self.get_fields([sources])[0]
+
+    def distance(self, source: int, target: int):
+        """
+        Function that returns the length of the shortest walk from source to target, -1 if it cannot be reached.
+        Once the field of source is cached it costs O(1)
+        """
+
+        return int(self.field([source])[target])
+
+    def reachable(self, source: int, target: int):
+        return self.distance(source, target) >= 0
+
+    def farthest(self, sources, count: int = 1):
+        """
+        Function that returns the count reachable cells farthest from the sources, the farthest first
+        """
+
+        field = self.field(sources)
+        cells = np.argsort(-field, kind="stable")[:count]
+        return cells[field[cells] > 0]
+
+
+def place_loot(fields: DistanceFields, spawn: int, min_distance: int, max_distance=None):
+    """
+    Function that places the chests, bags and monsters of the current map only on the cells reachable from spawn
+    and between min_distance and max_distance steps away from it
+    """
+
+    allowed = loot_mask(fields.field([spawn]), min_distance, max_distance)
+    chest_grid = objects.place_chests(allowed)
+    monsters.place_monsters(chest_grid, allowed=allowed)
+
+    return chest_grid
@@ -0,0 +1,181 @@
+import struct
+
+import numpy as np
+
+import monsters
+import objects
+import terrain
+from config import *
+
+# Binary map layout, all little endian:
+#   header      MAGIC, version, layer count, width, height, seed, rule (preset number, -1 for the other rules)
+#   layer table name (16 bytes), kind, offset and count of every layer
+#   layer data  DENSE layers are height x width uint16 tile ids, SPARSE layers are (x, y, id) records
+MAGIC = b"CAVEMAP\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIIqi")
+LAYER = struct.Struct("<16sB7xQQ")
+DENSE, SPARSE = 0, 1
+RECORD = np.dtype([("x", "<u4"), ("y", "<u4"), ("id", "<u2")])
+
+# Objects and monsters have names, so they get numeric ids in the binary format
+OBJECT_IDS = {"CHEST": 1, "BAG": 2, "MONSTER": 3}
+OBJECT_NAMES = {value: name for name, value in OBJECT_IDS.items()}
+
+
+def sparse_layer(grid, width: int):
+    """
+    Function that converts an object grid into (x, y, id) records, one for every object
+    """
+
+    coords = [coord for coord, item in enumerate(grid) if item]
+    records = np.zeros(len(coords), dtype=RECORD)
+    records["y"], records["x"] = np.divmod(np.array(coords, dtype=np.int64), width)
+    records["id"] = [OBJECT_IDS[grid[coord]] for coord in coords]
+
+    return records
+
+
+def write_binary(path: str, width: int, height: int, layers, seed: int = -1, rule=RULE):
+    """
+    Function that writes (name, kind, data) layers into a binary map file
+    """
+
+    # Layer data starts after the header and the layer table, aligned to 8 bytes
+    offset = HEADER.size + LAYER.size * len(layers)
+    table = []
+    for name, kind, data in layers:
+        if kind == DENSE and len(data) != width * height:
+            raise ValueError("Layer " + name + " has " + str(len(data)) + " tiles instead of " +
+                             str(width * height))
+        table.append(LAYER.pack(name.encode("ascii"), kind, offset, len(data)))
+        offset += (data.nbytes + 7) // 8 * 8
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(layers), width, height, seed, rule if isinstance(rule, int) else -1))
+        f.write(b"".join(table))
+        for _, _, data in layers:
+            f.write(data.tobytes())
+            f.write(b"\0" * (-data.nbytes % 8))
+
+
+def save_grid_to_binary(path="output/map.cave", seed: int = -1):
+    """
+    Function that writes the current map, with the same layers as the JSON export, into a binary map file
+    """
+
+    layers = [
+        ("Layer_0", DENSE, np.asarray(terrain.tile_map, dtype="<u2")),
+        ("Layer_1", SPARSE, sparse_layer(objects.chest_grid, w)),
+        ("Layer_2", SPARSE, sparse_layer(monsters.monster_grid, w)),
+    ]
+
+    # If it is enabled save also previous layer, once there is one
+    if DEPTH and len(terrain.old_tile_map) > 0:
+        layers.append(("Layer_10", DENSE, np.asarray(terrain.old_tile_map, dtype="<u2")))
+
+    write_binary(path, w, h, layers, seed)
+    print("Saved grid to " + path)
+
+
+def load_binary(path: str):
+    """
+    Function that opens a binary map file without reading its layers: they are memory-mapped, so slicing
+    a region of a DENSE layer (indexed as [y, x]) or filtering a SPARSE one only reads the pages it needs
+    """
+
+    with open(path, "rb") as f:
+        magic, version, count, width, height, seed, rule = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a version " + str(VERSION) + " binary map")
+        table = [LAYER.unpack(f.read(LAYER.size)) for _ in range(count)]
+
+    layers = {}
+    for name, kind, offset, length in table:
+        name = name.rstrip(b"\0").decode("ascii")
+        if kind == DENSE:
+            layers[name] = np.memmap(path, dtype="<u2", mode="r", offset=offset, shape=(height, width))
+        elif length == 0:
+            # Empty layers cannot be mapped
+            layers[name] = np.zeros(0, dtype=RECORD)
+        else:
+            layers[name] = np.memmap(path, dtype=RECORD, mode="r", offset=offset, shape=(length,))
+
+    return {"width": width, "height": height, "seed": seed, "rule": rule, "layers": layers}
+
+
+def read_region(map_file, name: str, x: int, y: int, width: int, height: int):
+    """
+    Function that reads a width x height region of a layer from a map opened with load_binary.
+    DENSE layers return the tile ids, SPARSE layers the records inside the region
+    """
+
+    layer = map_file["layers"][name]
+    if layer.dtype == RECORD:
+        inside = (layer["x"] >= x) & (layer["x"] < x + width) & (layer["y"] >= y) & (layer["y"] < y + height)
+        return np.array(layer[inside])
+
+    return np.array(layer[y:y + height, x:x + width])
+
+
+def stream_grid_to_json(path="output/map.json", encoding: str = JSON_ENCODING):
+    """
+    Function that writes the map as JSON row by row while walking the grids, so memory does not grow with the map.
+    The tile layers are written tile by tile (TILES, like the old export), as runs of the same tile in every row (RLE)
+    or as one comma separated string for every row (CSV)
+    """
+
+    with open(path, "w") as f:
+        f.write('{"layers": [\n')
+        write_tile_layer(f, "Layer_0", terrain.tile_map, encoding)
+        f.write(",\n")
+        write_object_layer(f, "Layer_1", objects.chest_grid)
+        f.write(",\n")
+        write_object_layer(f, "Layer_2", monsters.monster_grid)
+
+        # If it is enabled save also previous layer, once there is one
+        if DEPTH and len(terrain.old_tile_map) > 0:
+            f.write(",\n")
+            write_tile_layer(f, "Layer_10", terrain.old_tile_map, encoding)
+        f.write("\n]}\n")
+
+    print("Saved grid to " + path)
+
+
+def write_tile_layer(f, name: str, tile_map, encoding: str):
+    if encoding == "TILES":
+        f.write('{"name": "' + name + '", "tiles": [\n')
+    else:
+        f.write('{"name": "' + name + '", "encoding": "' + encoding.lower() + '", "width": ' + str(w) +
+                ', "height": ' + str(h) + ', "rows": [\n')
+
+    for j in range(h):
+        row = np.asarray(tile_map[j * w:(j + 1) * w])
+        if encoding == "TILES":
+            line = ",\n".join('{"id": "' + str(tile) + '", "x": ' + str(i) + ', "y": ' + str(j) + '}'
+                              for i, tile in enumerate(row.tolist()))
+        elif encoding == "RLE":
+            # [tile id, run length] for every run of the same tile
+            starts = np.flatnonzero(np.diff(row, prepend=-1) != 0)
+            lengths = np.diff(starts, append=len(row))
+            line = "[" + ", ".join("[" + str(tile) + ", " + str(length) + "]"
+                                   for tile, length in zip(row[starts].tolist(), lengths.tolist())) + "]"
+        elif encoding == "CSV":
+            line = '"' + ",".join(str(tile) for tile in row.tolist()) + '"'
+        else:
+            raise ValueError("Unknown JSON encoding " + encoding)
+
+        f.write(line)
+        f.write(",\n" if j < h - 1 else "\n")
+
+    f.write("]}")
+
+
+def write_object_layer(f, name: str, grid):
+    f.write('{"name": "' + name + '", "tiles": [')
+    separator = "\n"
+    for coord, item in enumerate(grid):
+        if item:
+            f.write(separator + '{"id": "' + item + '", "x": ' + str(coord % w) + ', "y": ' + str(coord // w) + '}')
+            separator = ",\n"
+    f.write("\n]}")
@@ -0,0 +1,218 @@
+import random
+from collections import deque
+
+import numpy as np
+
+import automaton
+import autotile
+import monsters
+import objects
+import regions
+import rules
+from config import *
+from terrain import Stability
+
+
+class CaveGenerator:
+    """
+    Cave generator holding all its state, so many of them can run in the same process or thread.
+    The walls live in two preallocated buffers padded with walls by the radius of the rule: every generation is
+    written into the back buffer from the front one, then the two are swapped, so stepping allocates little more
+    than the indices of the changed cells. With the same seed it builds the same maps as the terrain, objects
+    and monsters modules after random.seed(seed)
+    """
+
+    __slots__ = ["width", "height", "rule", "update_mode", "schedule", "initial_prob", "depth", "radius", "min_region",
+                 "connect", "rng", "front", "back",
+                 "table", "counts", "different", "solid", "changed_cells", "hash_keys", "tile_map", "old_tile_map",
+                 "chest_grid", "monster_grid"]
+
+    def __init__(self, width: int = w, height: int = h, seed=None, rule=RULE, update_mode: str = UPDATE_MODE,
+                 initial_prob: float = INITIAL_PROB, depth: bool = DEPTH, radius: int = None,
+                 min_region: int = MIN_REGION_SIZE, connect: bool = CONNECT_REGIONS, schedule: str = ASYNC_SCHEDULE):
+        self.width = width
+        self.height = height
+        # Compiled once, rule is anything rules.get_rule accepts
+        self.rule = rules.get_rule(rule)
+        self.update_mode = update_mode
+        self.schedule = schedule
+        self.initial_prob = initial_prob
+        self.depth = depth
+        # Chests are at least radius cells apart, RADIUS scales with the map like config does
+        self.radius = int(width / 10) if radius is None else radius
+        self.min_region = min_region
+        self.connect = connect
+        self.rng = random.Random(seed)
+
+        # Walls with a margin of walls wide enough for the rule, the cells are the inner part of the buffers
+        area = self.rule.radius
+        self.front = np.ones((height + 2 * area, width + 2 * area), dtype=bool)
+        self.back = np.ones_like(self.front)
+
+        # Summed-area table of the front buffer, the wall counts (already as indices of solid) and the changed cells
+        self.table = np.zeros((height + 2 * area + 1, width + 2 * area + 1), dtype=np.int32)
+        self.counts = np.zeros((height, width), dtype=np.intp)
+        self.different = np.zeros((height, width), dtype=bool)
+
+        # Whether every possible state and wall count becomes a wall, as indices state * columns + count
+        self.solid = self.rule.table.reshape(-1)
+
+        self.changed_cells = None
+        self.hash_keys = None
+        self.tile_map = np.zeros(0, dtype=np.int32)
+        self.old_tile_map = np.zeros(0, dtype=np.int32)
+        self.chest_grid = [False] * (width * height)
+        self.monster_grid = [False] * (width * height)
+
+    @property
+    def tiles(self):
+        # Walls of the current generation indexed as [y, x], a view of the front buffer
+        return self.cells(self.front)
+
+    def cells(self, buffer):
+        area = (buffer.shape[0] - self.height) // 2
+        return buffer[area:area + self.height, area:area + self.width]
+
+    def setup(self, tile: bool = True):
+        """
+        Function that fills the grid with random walls and builds its tile map, or leaves it empty without tile,
+        like terrain.setup
+        """
+
+        width, height = self.width, self.height
+
+        # Margins are always walls, the random numbers are drawn only for the inner cells
+        tiles = self.tiles
+        tiles[:] = True
+        noise = np.array([self.rng.random() for _ in range((width - 2) * (height - 2))]).reshape(height - 2, width - 2)
+        tiles[1:-1, 1:-1] = noise < self.initial_prob
+
+        self.changed_cells = None
+        if tile:
+            self.to_tile_set()
+        else:
+            self.tile_map = np.zeros(0, dtype=np.int32)
+            self.old_tile_map = np.zeros(0, dtype=np.int32)
+
+    def step(self):
+        """
+        Function that makes an iteraction with the update mode of the generator, writing it into the back buffer
+        and swapping the buffers. Sets changed_cells like terrain.iterate_once
+        """
+
+        width, height = self.width, self.height
+        size = self.front.shape[0] - height + 1
+        rule, table, counts = self.rule, self.table, self.counts
+        new_tiles = self.cells(self.back)
+
+        if self.update_mode == "RANDOM":
+            # Asynchronous update in place of a copy of the tiles, like terrain.iterate_tiles_randomly
+            np.copyto(new_tiles, self.tiles)
+            rng = np.random.default_rng(self.rng.getrandbits(64))
+            self.changed_cells = automaton.step_async(new_tiles, self.rule, rng, self.schedule)
+            self.front, self.back = self.back, self.front
+            return
+
+        if rule.box:
+            # Wall counts of every cell from the summed-area table of the padded front buffer
+            np.copyto(table[1:, 1:], self.front)
+            np.cumsum(table[1:, 1:], axis=0, out=table[1:, 1:])
+            np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+            np.subtract(table[size:, size:], table[:height, size:], out=counts)
+            np.subtract(counts, table[size:, :width], out=counts)
+            np.add(counts, table[:height, :width], out=counts)
+        else:
+            np.copyto(counts, automaton.count_kernel(self.front, rule.kernel))
+
+        if not rule.totalistic:
+            # Walls read the second row of the table
+            np.add(counts, rule.table.shape[1], out=counts, where=self.tiles)
+
+        np.take(self.solid, counts, out=new_tiles, mode="clip")
+
+        # Ensure tiles at the margins remain walls
+        new_tiles[0, :] = new_tiles[-1, :] = new_tiles[:, 0] = new_tiles[:, -1] = True
+
+        np.not_equal(new_tiles, self.tiles, out=self.different)
+        self.changed_cells = np.flatnonzero(self.different)
+        self.front, self.back = self.back, self.front
+
+    def run_until_stable(self, max_iters: int, window: int = CYCLE_WINDOW):
+        """
+        Function that steps until the tiles stop changing or repeat one of the last window generations,
+        at most max_iters times, like terrain.run_until_stable
+        """
+
+        if self.hash_keys is None:
+            self.hash_keys = automaton.hash_keys(self.width * self.height)
+
+        generation_hash = automaton.grid_hash(self.hash_keys, self.tiles.ravel())
+        seen = {generation_hash: 0}
+        history = deque([generation_hash])
+
+        for iteration in range(1, max_iters + 1):
+            self.step()
+            if len(self.changed_cells) == 0:
+                return Stability(iteration, 1)
+
+            generation_hash ^= automaton.grid_hash(self.hash_keys, self.changed_cells)
+            if generation_hash in seen:
+                return Stability(iteration, iteration - seen[generation_hash])
+
+            seen[generation_hash] = iteration
+            history.append(generation_hash)
+            if len(history) > window:
+                del seen[history.popleft()]
+
+        return Stability(max_iters, 0)
+
+    def clean_regions(self):
+        """
+        Function that fills the caves smaller than min_region cells and, with connect, joins the others,
+        like terrain.clean_regions
+        """
+
+        walls, self.changed_cells = regions.clean_regions(self.tiles, self.min_region, self.connect)
+        self.tiles[:] = walls
+
+    def to_tile_set(self, cells=None):
+        """
+        Function that builds the tile map from the tiles, or only around the changed cells, like terrain.to_tile_set
+        """
+
+        rng = np.random.default_rng(self.rng.getrandbits(64))
+
+        if cells is not None and len(self.tile_map) == self.width * self.height and \
+                len(cells) * 25 < self.width * self.height:
+            if self.depth:
+                self.old_tile_map = self.tile_map.copy()
+            autotile.update_tile_map(self.tile_map, self.tiles, cells, rng)
+            return
+
+        if self.depth:
+            self.old_tile_map = self.tile_map
+        self.tile_map = autotile.build_tile_map(self.tiles, rng, COUNT_MODE)
+
+    def place_objects(self):
+        """
+        Function that places the chests and the monsters, like objects.place_chests and monsters.place_monsters
+        """
+
+        self.chest_grid = objects.build_chest_grid(self.tile_map, self.tiles, self.width, self.height, self.rng,
+                                                   self.radius)
+        self.monster_grid = monsters.build_monster_grid(self.tile_map, self.chest_grid, self.width, self.height,
+                                                        self.rng)
+
+    def generate(self, iterations: int):
+        """
+        Function that builds a whole map, like batch.generate_map: the automata stops after iterations iteractions
+        or as soon as it is stable, then the caves are cleaned
+        """
+
+        self.setup(tile=False)
+        stability = self.run_until_stable(iterations)
+        self.clean_regions()
+        self.to_tile_set()
+        self.place_objects()
+
+        return stability
@@ -1,121 +1,126 @@
-import json
-import random
-
 import pygame
+import export
+import render
+import stats
 import terrain
-from CaveGeneration.monsters import save_monsters_to_json, monster_grid, place_monsters
+import worker
+from monsters import monster_grid
 from config import *
-from CaveGeneration.objects import place_chests, save_chests_to_json
 
 show_text = False
+show_stats = STATS
+
+# Stats dump written next to the map
+STATS_PATH = "output/stats.json"
+
+# The fonts and the rendered texts
+font = None
+small_font = None
+texts = {}
+
+# Off-screen surface with the map and its RGB image composed by the worker, wrapped again only when map_changed
+map_surface = None
+map_image = None
+map_changed = True
+
+# Map shown in the window, the last one handed over by the generation worker
+tile_map = []
+old_tile_map = []
+
+# Commands sent to the generation worker and not finished yet, and the error of the last failed one
+pending = 0
+error = None
 
 
 def setup():
-    global tiles, chest_grid
-    terrain.tiles = []
+    global chest_grid, tile_map, old_tile_map, map_image, map_changed
     chest_grid = [False] * (w * h)
+    if LEVELS > 1:
+        # Caves generated coarse to fine, see multires.py
+        terrain.setup_levels(LEVELS)
+    else:
+        terrain.setup()
+    tile_map = terrain.tile_map.copy()
+    old_tile_map = terrain.old_tile_map
+    map_image = None
+    map_changed = True
+
+
+def load_fonts():
+    global font, small_font
+    font = pygame.font.Font(None, 36)
+    small_font = pygame.font.Font(None, 20)
 
-    for j in range(h):
-        for i in range(w):
-            # Ensure tiles at the margins are always walls
-            if i == 0 or i == w - 1 or j == 0 or j == h - 1:
-                terrain.tiles.append(True)  # Solid (wall)
-            else:
-                solid = random.random() < INITIAL_PROB
-                terrain.tiles.append(solid)
-    terrain.to_tile_set()
+
+def render_map():
+    """
+    Function that wraps the image of the map into the off-screen map surface, composing it first if the worker
+    did not (the map of setup)
+    """
+
+    global map_surface, map_image, map_changed
+    if map_image is None:
+        map_image = render.render(tile_map, chest_grid, monster_grid, w, h, TILE_SIZE,
+                                  old_tile_map if DEPTH else None)
+
+    # The surface reads the pixels of the image, which is kept as long as the surface
+    map_surface = pygame.image.frombuffer(map_image, (w * TILE_SIZE, h * TILE_SIZE), "RGB")
+    map_changed = False
 
 
 def draw(screen):
     global show_text
     screen.fill((24, 20, 37))
 
-    # Draw the grid
-    for j in range(h):
-        for i in range(w):
-            tile = terrain.tile_map[i + j * w]
-            img = terrain.tile_set[tile]
-            screen.blit(pygame.transform.scale(img, (TILE_SIZE, TILE_SIZE)), (i * TILE_SIZE, j * TILE_SIZE))
-
-            if terrain.old_tile_map and DEPTH:
-                tile = terrain.old_tile_map[i + j * w]
-                img = terrain.tile_set[tile]
-                screen.blit(pygame.transform.scale(img, (TILE_SIZE, TILE_SIZE)), (i * TILE_SIZE, j * TILE_SIZE))
-
-            # Draw chests
-            if chest_grid[i + j * w] == terrain.tile_set["CHEST"]:
-                chest_img = terrain.tile_set["CHEST"]
-                screen.blit(pygame.transform.scale(chest_img, (TILE_SIZE, TILE_SIZE)), (i * TILE_SIZE, j * TILE_SIZE))
-            elif chest_grid[i + j * w] == terrain.tile_set["BAG"]:
-                bag_img = terrain.tile_set["BAG"]
-                screen.blit(pygame.transform.scale(bag_img, (TILE_SIZE, TILE_SIZE)), (i * TILE_SIZE, j * TILE_SIZE))
-
-            if monster_grid[i + j * w] == terrain.tile_set["MONSTER"]:
-                monster_img = terrain.tile_set["MONSTER"]
-                screen.blit(pygame.transform.scale(monster_img, (TILE_SIZE, TILE_SIZE)), (i * TILE_SIZE, j * TILE_SIZE))
+    # Draw the grid, the map surface is redrawn only when the map changed
+    if map_changed:
+        render_map()
+    screen.blit(map_surface, (0, 0))
 
     # Draw the save button to the right of the grid
     save_button = pygame.Rect(GRID_WIDTH + 10, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2, BUTTON_WIDTH, BUTTON_HEIGHT)
     pygame.draw.rect(screen, (65, 53, 102), save_button)
-    font = pygame.font.Font(None, 36)
-    text = font.render("Save Image", True, (192, 203, 220))
-    screen.blit(text, (GRID_WIDTH + 20, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 + 10))
+    screen.blit(render_text("Save Image"), (GRID_WIDTH + 20, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 + 10))
 
     # Draw the save button
     save_file_button = pygame.Rect(GRID_WIDTH + 10, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 + 10 + BUTTON_HEIGHT,
                                    BUTTON_WIDTH, BUTTON_HEIGHT)
     pygame.draw.rect(screen, (65, 53, 102), save_file_button)
-    font = pygame.font.Font(None, 36)
-    text2 = font.render("Save Map", True, (192, 203, 220))
-    screen.blit(text2, (GRID_WIDTH + 20, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 + 20 + BUTTON_HEIGHT))
-
-    if show_text:
-        text3 = font.render("Walls stable", True, (192, 203, 220))
-        screen.blit(text3, (GRID_WIDTH + 20, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 - 20 - BUTTON_HEIGHT))
+    screen.blit(render_text("Save Map"), (GRID_WIDTH + 20, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 + 20 + BUTTON_HEIGHT))
+
+    if error is not None:
+        screen.blit(render_text("Command failed"),
+                    (GRID_WIDTH + 20, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 - 20 - BUTTON_HEIGHT))
+    elif pending:
+        screen.blit(render_text("Generating..."),
+                    (GRID_WIDTH + 20, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 - 20 - BUTTON_HEIGHT))
+    elif show_text:
+        screen.blit(render_text("Walls stable"),
+                    (GRID_WIDTH + 20, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 - 20 - BUTTON_HEIGHT))
+
+    # Draw the time and the cells of the last phases under the buttons, they change every frame so are not cached
+    if show_stats:
+        for n, line in enumerate(stats.summary()):
+            screen.blit(small_font.render(line, True, (192, 203, 220)),
+                        (GRID_WIDTH + 10, (WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 + 30 + 2 * BUTTON_HEIGHT + n * 18))
 
     pygame.display.flip()
 
 
-def save_grid_to_json():
-    layers = [tile_list("Layer_0"), save_chests_to_json(), save_monsters_to_json()]
-
-    # If it is enabled save also previous layer
-    if DEPTH:
-        layer = {
-            "name": "Layer_10",
-            "tiles": []
-        }
-        for j in range(h):
-            for i in range(w):
-                tile_id = terrain.old_tile_map[i + j * w]
-                layer["tiles"].append({
-                    "id": str(tile_id),
-                    "x": i,
-                    "y": j
-                })
-        layers.append(layer)
-
-    with open("output/map.json", "w") as f:
-        json.dump({"layers": layers}, f, indent=4)
-
-    print("Saved grid to map.json")
-
-
-def tile_list(layer_name):
-    layer = {
-        "name": layer_name,
-        "tiles": []
-    }
-    for j in range(h):
-        for i in range(w):
-            tile_id = terrain.tile_map[i + j * w]
-            layer["tiles"].append({
-                "id": str(tile_id),
-                "x": i,
-                "y": j
-            })
-
-    return layer
+def render_text(text):
+    # Texts never change, so each one is rendered once
+    if text not in texts:
+        texts[text] = font.render(text, True, (192, 203, 220))
+    return texts[text]
+
+
+def save_grid_to_json(path="output/map.json", encoding=JSON_ENCODING):
+    # Stream the layers into the file instead of building them in memory
+    export.stream_grid_to_json(path, encoding)
+
+    # Save also the stats of the phases, if they are recorded
+    if stats.enabled:
+        stats.save_stats_to_json(STATS_PATH)
 
 
 def save_image(screen):
@@ -125,22 +130,67 @@ def save_image(screen):
     print("Image saved as map.png")
 
 
+def receive(generation_worker):
+    """
+    Function that takes the maps finished by the generation worker, only the last one is shown
+    """
+
+    global chest_grid, monster_grid, tile_map, old_tile_map, show_text, map_image, map_changed, pending, error
+    snapshot = None
+    while not generation_worker.results.empty():
+        result = generation_worker.results.get()
+        pending -= result["done"]
+        error = result["error"]
+        if result["stable"] is not None:
+            show_text = result["stable"]
+        # A snapshot that failed has no map
+        if "tile_map" in result:
+            snapshot = result
+
+    if snapshot is not None:
+        tile_map = snapshot["tile_map"]
+        old_tile_map = snapshot["old_tile_map"]
+        chest_grid = snapshot["chest_grid"]
+        monster_grid = snapshot["monster_grid"]
+        map_image = snapshot["image"]
+        map_changed = True
+
+
+def send(generation_worker, command):
+    global pending
+    pending += 1
+    generation_worker.request(command)
+
+
 def main():
-    global chest_grid, show_text, monster_grid
+    global show_stats
     pygame.init()
     screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
     pygame.display.set_caption("Cellular Automata Cave Generation")
     clock = pygame.time.Clock()
 
-    actual_walls = 0
-    terrain.preload()
+    load_fonts()
     setup()
 
+    # Iteractions, tiling and placing run on the worker, the loop only draws
+    generation_worker = worker.GenerationWorker()
+    generation_worker.start()
+
     running = True
     while running:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_s:
+                # Toggle the stats overlay, the phases are recorded only while it is shown or STATS is set
+                show_stats = not show_stats
+                if show_stats:
+                    stats.enable()
+                elif not STATS:
+                    stats.disable()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_c:
+                # Fill the small caves and connect the others
+                send(generation_worker, worker.CLEAN)
             elif event.type == pygame.MOUSEBUTTONUP:
                 # Check if the save button is clicked
                 mouse_pos = pygame.mouse.get_pos()
@@ -153,25 +203,20 @@ def main():
                         WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 + BUTTON_HEIGHT <= mouse_pos[1] <= (
                         WINDOW_HEIGHT - BUTTON_HEIGHT) // 2 + (2 * BUTTON_HEIGHT):
                     print("Saving map...")
-                    save_grid_to_json()
+                    # The map is saved by the worker, after the commands sent before
+                    send(generation_worker, save_grid_to_json)
                 else:
-                    if UPDATE_MODE == "RANDOM":
-                        terrain.iterate_tiles_randomly()
-                    else:
-                        terrain.iterate_tiles()
-
-                    terrain.to_tile_set()
-                    chest_grid = place_chests()
-                    monster_grid = place_monsters(chest_grid)
-
-                    if actual_walls == terrain.wall_count():
-                        show_text = True
-                    else:
-                        actual_walls = terrain.wall_count()
-
-        draw(screen)
+                    # Clicks sent while the worker is busy are run together
+                    send(generation_worker, worker.STEP)
+
+        receive(generation_worker)
+        with stats.phase("draw") as phase:
+            # Cells drawn again, the map surface is reused when the map did not change
+            phase.cells = w * h if map_changed else 0
+            draw(screen)
         clock.tick(30)
 
+    generation_worker.stop()
     pygame.quit()
 
 
@@ -0,0 +1,113 @@
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import automaton
+import stats
+from config import *
+
+# Report of a level: its size, the iteractions made and the seconds spent on it (upsampling included)
+Level = namedtuple("Level", ["width", "height", "iterations", "seconds"])
+
+
+def level_sizes(width: int, height: int, levels: int):
+    """
+    Function that returns the size of every level from the coarsest to the full one, every level half the next
+    """
+
+    return [(-(-width // 2 ** level), -(-height // 2 ** level)) for level in reversed(range(levels))]
+
+
+def upsample(grid, width: int, height: int):
+    """
+    Function that doubles every cell of a grid on both axes, cutting the result to width x height
+    """
+
+    return np.ascontiguousarray(np.repeat(np.repeat(grid, 2, axis=0), 2, axis=1)[:height, :width])
+
+
+def edges(grid):
+    # Cells with both walls and floor in their 3x3 area, where the upsampled caves are going to be blocky
+    counts = automaton.count_walls(grid, 1)
+    return (counts > 0) & (counts < 9)
+
+
+def smooth(grid, rule, iterations: int, mode: str = COUNT_MODE):
+    """
+    Function that steps the grid at most iterations times, stopping as soon as it is stable.
+    Returns the new grid and the iteractions made
+    """
+
+    for iteration in range(iterations):
+        new_grid = automaton.step(grid, rule, mode)
+        if np.array_equal(new_grid, grid):
+            return grid, iteration
+        grid = new_grid
+
+    return grid, iterations
+
+
+def generate(width: int, height: int, rng, rule=RULE, initial_prob: float = INITIAL_PROB, levels: int = LEVELS,
+             coarse_iterations: int = COARSE_ITERATIONS, refine_iterations: int = REFINE_ITERATIONS,
+             noise: float = REFINE_NOISE):
+    """
+    Function that generates the walls of a width x height map coarse to fine: the coarsest level is filled with
+    random walls and stepped like a normal map, then every level is upsampled to twice its size, the cells on the
+    edges of the caves are drawn again with probability noise (so the finer levels get their own roughness)
+    and only a few refinement iteractions smooth them. The features grow at the coarse levels, where an iteraction
+    costs a quarter of the next level, so the whole pyramid costs little more than 4 / 3 * refine_iterations full
+    size steps.
+    rng is a numpy generator.
+    Returns the walls indexed as [y, x] and the report of every level, the coarsest first
+    """
+
+    report = []
+    grid = None
+    for level_width, level_height in level_sizes(width, height, levels):
+        start = time.perf_counter()
+        if grid is None:
+            grid = rng.random((level_height, level_width)) < initial_prob
+            iterations = coarse_iterations
+        else:
+            # Edges found at the coarse level, a quarter of the cells to count
+            redraw = np.flatnonzero(upsample(edges(grid), level_width, level_height))
+            grid = upsample(grid, level_width, level_height)
+            redraw = redraw[rng.random(len(redraw)) < noise]
+            grid.reshape(-1)[redraw] = rng.random(len(redraw)) < initial_prob
+            iterations = refine_iterations
+
+        # Ensure tiles at the margins are always walls
+        grid[0, :] = grid[-1, :] = grid[:, 0] = grid[:, -1] = True
+
+        grid, done = smooth(grid, rule, iterations)
+        report.append(Level(level_width, level_height, done, time.perf_counter() - start))
+        if stats.enabled:
+            stats.record("level " + str(len(report)), report[-1].seconds, level_width * level_height * done)
+
+    return grid, report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the walls of a map coarse to fine, timing every level")
+    parser.add_argument("width", type=int, help="width of the map")
+    parser.add_argument("height", type=int, help="height of the map")
+    parser.add_argument("-l", "--levels", type=int, default=max(LEVELS, 2), help="levels of the pyramid")
+    parser.add_argument("-c", "--coarse", type=int, default=COARSE_ITERATIONS,
+                        help="maximum iteractions of the coarsest level")
+    parser.add_argument("-r", "--refine", type=int, default=REFINE_ITERATIONS,
+                        help="maximum iteractions of every finer level")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the map")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    walls, levels = generate(args.width, args.height, np.random.default_rng(args.seed), levels=args.levels,
+                             coarse_iterations=args.coarse, refine_iterations=args.refine)
+    for level in levels:
+        print("{:>6} x {:<6} {:>3} iteractions {:10.6f} s".format(level.width, level.height, level.iterations,
+                                                                   level.seconds))
+    print("total {:.6f} s, walls {:.1%}".format(sum(level.seconds for level in levels), walls.mean()))
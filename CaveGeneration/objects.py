@@ -1,72 +1,103 @@
 import random
 
+import numpy as np
+
 from config import *
+import autotile
 import terrain
 
 chest_grid = [False] * (w * h)
 
-def place_chests():
+def place_chests(allowed=None):
     global chest_grid
-    chest_grid = [False] * (w * h)  # Initialize new chest grid
+    chest_grid = build_chest_grid(terrain.tile_map, terrain.tiles, w, h, allowed=allowed)
 
-    for j in range(h):
-        for i in range(w):
-            # Check if the tile is ground and not already occupied
-            if terrain.tile_map[i + j * w] in [GROUND, GROUND_BONES, GROUND_STONE] and not chest_grid[i + j * w]:
-
-                # CHEST PLACING
-                is_suitable = True
-
-                # Check if away from walls
-                directions = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-                for dx, dy in directions:
-                    for k in range(1, 3):
-                        nx, ny = i + (dx*k), j + (dy*k)
-                        if 0 < nx < w-1 and 0 < ny < h-1:
-                            # Into boundaries
-                            tile = terrain.tiles[nx + ny * w]
-
-                            if not tile:
-                                # it is not near a wall
-                                is_suitable = is_suitable and True
-                            else:
-                                is_suitable = is_suitable and False
-
-                # See if there is a chest in radius of 5
-                has_chest = False
-                radius = RADIUS
-
-                for x in range(i - radius, i + radius + 1):
-                    for y in range(j - radius, j + radius + 1):
-                        # Check if the cell is within the grid bounds
-                        if (0 <= x < w) and (0 <= y < h):
-                            # Calculate the distance from the center cell (x, y)
-                            distance = max(abs(x - i), abs(y - j))
-                            if distance <= radius:
-                                # Add the cell's coordinates and solidity to the list
-                                has_chest = has_chest or chest_grid[x + y * w]
-
-                if is_suitable and not has_chest:
-                    if random.random() < CHEST_PROB:
-                        chest_grid[i + j * w] = terrain.tile_set["CHEST"]
-
-                # BAG PLACING
-                # if it is a chest, then it has chance to spawn little bags
-                radius = 1
-                for x in range(i - radius, i + radius + 1):
-                    for y in range(j - radius, j + radius + 1):
-                        # Check if the cell is within the grid bounds
-                        if (0 <= x < w) and (0 <= y < h):
-                            # Calculate the distance from the center cell (x, y)
-                            distance = max(abs(x - i), abs(y - j))
-                            # If the tile is in distance and the origin is a chest
-                            if distance <= radius and chest_grid[i + j * w] and not terrain.is_solid(x, y):
-                                # Probability to spawn a bag
-                                if random.random() < BAG_PROB:
-                                    chest_grid[x + y * w] = terrain.tile_set["BAG"]
+    return chest_grid
+
+
+def build_chest_grid(tile_map, tiles, width: int, height: int, rng=random, radius=None, allowed=None,
+                     margins: bool = True):
+    """
+    Function that places chests and bags on a tile map of any size, returning the new chest grid.
+    Chests are at least radius cells apart (RADIUS by default), and chests and bags go only on the allowed cells
+    if it is given (a flat boolean mask, e.g. distances.loot_mask). Without margins the outer rows and columns are
+    cave cells like any other, e.g. the edges of a chunk, and their walls count.
+    Wall distances and the cells already near a chest are kept in grids, so every cell is checked in O(1)
+    """
+
+    if radius is None:
+        radius = RADIUS
+
+    chest_grid = [False] * (width * height)  # Initialize new chest grid
+    walls = np.asarray(tiles, dtype=bool).reshape(height, width)
+
+    # Ground cells away from walls, the same check for all the chests
+    ground = autotile.is_ground(np.asarray(tile_map)).reshape(height, width)
+    candidates = ground & (wall_distance(walls, margins) > CHEST_CLEARANCE)
+
+    # Bags go on the floor around the chests, on the allowed cells too
+    bag_cells = ~walls
+    if allowed is not None:
+        allowed = np.asarray(allowed, dtype=bool).reshape(height, width)
+        candidates &= allowed
+        bag_cells &= allowed
+    candidates = np.flatnonzero(candidates)
+
+    # Cells with a chest or a bag in radius, updated as they are placed
+    excluded = np.zeros((height, width), dtype=bool)
+
+    def place(x, y, item):
+        chest_grid[x + y * width] = item
+        excluded[max(y - radius, 0):y + radius + 1, max(x - radius, 0):x + radius + 1] = True
+
+    for coord in candidates.tolist():
+        i, j = coord % width, coord // width
+
+        # Check if the tile is not already occupied and there is no chest in radius
+        if chest_grid[coord] or excluded[j, i]:
+            continue
+
+        # CHEST PLACING
+        if rng.random() < CHEST_PROB:
+            place(i, j, "CHEST")
+
+            # BAG PLACING
+            # if it is a chest, then it has chance to spawn little bags
+            for x in range(i - 1, i + 2):
+                for y in range(j - 1, j + 2):
+                    # Check if the cell is within the grid bounds, not a wall and allowed
+                    if (0 <= x < width) and (0 <= y < height) and bag_cells[y, x]:
+                        # Probability to spawn a bag
+                        if rng.random() < BAG_PROB:
+                            place(x, y, "BAG")
 
     return chest_grid
 
+
+def wall_distance(walls, margins: bool = True):
+    """
+    Function that computes for every cell how far the nearest wall is, looking only left, right, up and down.
+    With margins the walls at the margins are ignored, the cells with no wall in sight get width + height
+    """
+
+    inner_walls = walls.copy()
+    if margins:
+        inner_walls[0, :] = inner_walls[-1, :] = inner_walls[:, 0] = inner_walls[:, -1] = False
+
+    distance = np.full(walls.shape, walls.shape[0] + walls.shape[1], dtype=np.int64)
+    for turn in range(4):
+        # Distance to the nearest wall on the left, for the grid turned 4 times
+        turned = np.rot90(inner_walls, turn)
+        far = turned.shape[0] + turned.shape[1]
+        columns = np.arange(turned.shape[1])
+        last_wall = np.maximum.accumulate(np.where(turned, columns, -far), axis=1)
+        left = np.full(turned.shape, far, dtype=np.int64)
+        left[:, 1:] = columns[1:] - last_wall[:, :-1]
+        distance = np.minimum(distance, np.rot90(left, -turn))
+
+    return distance
+
+
 def save_chests_to_json():
     global chest_grid
     chest_layer = {
@@ -76,7 +107,7 @@ def save_chests_to_json():
     for j in range(h):
         for i in range(w):
             # Add Chests
-            if chest_grid[i + j * w] == terrain.tile_set["CHEST"]:
+            if chest_grid[i + j * w] == "CHEST":
                 chest_layer["tiles"].append({
                     "id": "CHEST",
                     "x": i,
@@ -84,7 +115,7 @@ def save_chests_to_json():
                 })
 
             # Add Bags
-            elif chest_grid[i + j * w] == terrain.tile_set["BAG"]:
+            elif chest_grid[i + j * w] == "BAG":
                 chest_layer["tiles"].append({
                     "id": "BAG",
                     "x": i,
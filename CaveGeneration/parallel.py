@@ -0,0 +1,155 @@
+import multiprocessing
+import multiprocessing.connection
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import automaton
+import rules
+from config import *
+
+
+def stripes(height: int, workers: int):
+    """
+    Function that splits the rows of the grid into workers horizontal stripes of (almost) the same height
+    """
+
+    bounds = np.linspace(0, height, workers + 1).astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def step_stripe(front, back, y0: int, y1: int, rule, border: bool = True):
+    """
+    Function that makes an iteraction for the rows y0 to y1 of a grid padded with walls by the radius of the rule,
+    reading the stripe and the halo rows of its neighbours from front and writing the new rows into back.
+    Returns the number of changed cells
+    """
+
+    rule = rules.get_rule(rule)
+    radius = rule.radius
+    height, width = front.shape[0] - 2 * radius, front.shape[1] - 2 * radius
+
+    old_rows = front[y0 + radius:y1 + radius, radius:radius + width]
+    counts = automaton.count_rule(front[y0:y1 + 2 * radius], rule)
+    new_rows = rules.lookup(rule, old_rows, counts)
+    if border:
+        # Ensure tiles at the margins remain walls
+        new_rows[:, 0] = new_rows[:, -1] = True
+        if y0 == 0:
+            new_rows[0] = True
+        if y1 == height:
+            new_rows[-1] = True
+
+    changed = int(np.count_nonzero(new_rows != old_rows))
+    back[y0 + radius:y1 + radius, radius:radius + width] = new_rows
+
+    return changed
+
+
+def work(names, shape, index: int, y0: int, y1: int, rule, border: bool, iterations: int, until_stable: bool,
+         barrier, changes_name: str):
+    """
+    Function run by every worker: it steps its stripe iterations times, swapping the two shared buffers.
+    The barrier makes every worker wait for the others, so the halo rows read from the neighbours are always
+    the ones of the same generation. When a worker fails it aborts the barrier, so the others stop too
+    """
+
+    blocks = [shared_memory.SharedMemory(name=name) for name in names + [changes_name]]
+    buffers = [np.ndarray(shape, dtype=bool, buffer=block.buf) for block in blocks[:2]]
+    # Changed cells of every stripe, one row for the even generations and one for the odd ones,
+    # and the iteractions made by every worker
+    changes = np.ndarray((3, barrier.parties), dtype=np.int64, buffer=blocks[2].buf)
+
+    done = iterations
+    for iteration in range(iterations):
+        front, back = buffers[iteration % 2], buffers[(iteration + 1) % 2]
+        try:
+            changes[iteration % 2, index] = step_stripe(front, back, y0, y1, rule, border)
+        except BaseException:
+            # Wake up the workers waiting for this one, or they would wait at the barrier forever
+            barrier.abort()
+            raise
+        del front, back
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            # Another worker failed and reported it, this one just stops
+            done = -1
+            break
+
+        # Every worker sees the same changes, so they all stop together
+        if until_stable and changes[iteration % 2].sum() == 0:
+            done = iteration + 1
+            break
+    changes[2, index] = done
+
+    # The arrays have to be released before closing the shared memory
+    del buffers, changes
+    for block in blocks:
+        block.close()
+
+
+def run(grid, rule=RULE, iterations: int = 1, workers=WORKERS, border: bool = True,
+        until_stable: bool = False):
+    """
+    Function that makes iterations iteractions of the whole grid, split into horizontal stripes stepped in parallel
+    by workers processes (one per core by default) inside shared memory. The result is the same as automaton.step.
+    With until_stable it stops as soon as a generation changes nothing.
+    Returns the new grid, the number of iteractions made and the number of cells changed by the last one
+    """
+
+    height, width = grid.shape
+    rule = rules.get_rule(rule)
+    radius = rule.radius
+    workers = max(1, min(workers or multiprocessing.cpu_count(), height))
+    shape = (height + 2 * radius, width + 2 * radius)
+
+    blocks = [shared_memory.SharedMemory(create=True, size=shape[0] * shape[1]) for _ in range(2)]
+    blocks.append(shared_memory.SharedMemory(create=True, size=3 * workers * 8))
+    try:
+        # Both buffers are padded with walls, only their inner cells are ever written
+        for block in blocks[:2]:
+            buffer = np.ndarray(shape, dtype=bool, buffer=block.buf)
+            buffer[:] = True
+            buffer[radius:radius + height, radius:radius + width] = grid
+        changes = np.ndarray((3, workers), dtype=np.int64, buffer=blocks[2].buf)
+        changes[:] = 0
+
+        names = [block.name for block in blocks[:2]]
+        if workers == 1:
+            # No processes to start for a single stripe
+            work(names, shape, 0, 0, height, rule, border, iterations, until_stable, threading.Barrier(1),
+                 blocks[2].name)
+        else:
+            barrier = multiprocessing.Barrier(workers)
+            processes = [multiprocessing.Process(target=work, args=(names, shape, index, y0, y1, rule, border,
+                                                                    iterations, until_stable, barrier,
+                                                                    blocks[2].name))
+                         for index, (y0, y1) in enumerate(stripes(height, workers))]
+            for process in processes:
+                process.start()
+            # A worker killed without raising (e.g. by the system when out of memory) cannot abort the barrier itself
+            running = {process.sentinel: process for process in processes}
+            while running:
+                for sentinel in multiprocessing.connection.wait(list(running)):
+                    process = running.pop(sentinel)
+                    process.join()
+                    if process.exitcode != 0:
+                        barrier.abort()
+            if any(process.exitcode != 0 for process in processes) or (changes[2] < 0).any():
+                raise RuntimeError("A worker of the parallel step failed")
+
+        # After an even number of iteractions the grid is back in the first buffer
+        done = int(changes[2, 0])
+        last_changes = int(changes[(done - 1) % 2].sum()) if done else 0
+        result = np.ndarray(shape, dtype=bool, buffer=blocks[done % 2].buf)
+        new_grid = result[radius:radius + height, radius:radius + width].copy()
+    finally:
+        # The arrays have to be released before closing the shared memory, also when a worker failed
+        buffer = changes = result = None
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return new_grid, done, last_changes
@@ -0,0 +1,190 @@
+import numpy as np
+
+# Cells next to a cell, moving left, right, up and down like the players
+STEPS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+
+def floor_runs(walls):
+    """
+    Function that finds the runs of floor cells of every row of a boolean grid of walls indexed as [y, x].
+    Returns their rows, first columns and ends (last column + 1), in the order of the flat indices
+    """
+
+    floor = np.pad(~walls, ((0, 0), (1, 1)), constant_values=False).view(np.int8)
+    edges = np.diff(floor, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+
+    return rows, starts, ends
+
+
+def find_roots(parent):
+    # Pointer jumping until every node points to its root
+    while True:
+        grand_parent = parent[parent]
+        if np.array_equal(grand_parent, parent):
+            return parent
+        parent = grand_parent
+
+
+def union_find(count: int, a, b):
+    """
+    Function that joins the nodes connected by the edges (a, b), hooking the larger root to the smaller one
+    for all the edges at once. Returns the root of every node
+    """
+
+    parent = np.arange(count)
+    while True:
+        parent = find_roots(parent)
+        root_a, root_b = parent[a], parent[b]
+        apart = root_a != root_b
+        if not apart.any():
+            return parent
+
+        root_a, root_b = root_a[apart], root_b[apart]
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+
+
+def label_regions(walls):
+    """
+    Function that labels the regions of floor cells connected left, right, up and down in a grid of walls.
+    The runs of floor of every row are found in one pass, then the runs touching in consecutive rows are joined
+    with union-find, so the work grows linearly with the cells.
+    Returns the labels indexed as [y, x] (0 for walls, regions from 1 in scan order) and the sizes of the regions
+    (sizes[0] is 0)
+    """
+
+    height, width = walls.shape
+    rows, starts, ends = floor_runs(walls)
+
+    # A run touches the runs of the row above that start before its end and end after its start.
+    # Keys grow with the runs, so the first and last of them are found with a binary search
+    start_keys = rows * (width + 1) + starts
+    end_keys = rows * (width + 1) + ends
+    below = rows > 0
+    first = np.searchsorted(end_keys, (rows[below] - 1) * (width + 1) + starts[below], side="right")
+    last = np.searchsorted(start_keys, (rows[below] - 1) * (width + 1) + ends[below], side="left")
+
+    touching = np.maximum(last - first, 0)
+    b = np.repeat(np.flatnonzero(below), touching)
+    a = np.repeat(first, touching) + np.arange(touching.sum()) - np.repeat(np.cumsum(touching) - touching, touching)
+
+    roots = union_find(len(starts), a, b)
+    _, run_regions = np.unique(roots, return_inverse=True)
+    run_regions = run_regions + 1
+
+    labels = np.zeros(height * width, dtype=np.int32)
+    labels[np.flatnonzero(~walls)] = np.repeat(run_regions, ends - starts)
+    sizes = np.bincount(run_regions, weights=ends - starts, minlength=1).astype(np.int64)
+
+    return labels.reshape(height, width), sizes
+
+
+def fill_small_regions(walls, labels, sizes, min_size: int):
+    """
+    Function that fills with walls the regions smaller than min_size cells, returning the new walls
+    """
+
+    small = sizes < min_size
+    small[0] = False
+    return walls | small[labels]
+
+
+def connect_regions(walls, labels, sizes):
+    """
+    Function that carves corridors through the walls so every region is reachable from every other.
+    All the regions grow through the walls at the same time, one cell per round, and where two of them meet
+    there is a corridor as short as possible between them; the cheapest corridors joining all the regions
+    (a minimum spanning tree) are carved. The margins are never carved.
+    Returns the new walls
+    """
+
+    height, width = walls.shape
+    count = len(sizes)
+    if np.count_nonzero(sizes) < 2:
+        return walls
+
+    flat_walls = walls.reshape(-1)
+    owner = labels.reshape(-1).astype(np.int64)
+    distance = np.where(owner > 0, 0, -1)
+    parent = np.full(height * width, -1, dtype=np.int64)
+
+    # Inner cells only, the margins stay walls
+    inner = np.zeros((height, width), dtype=bool)
+    inner[1:-1, 1:-1] = True
+    inner = inner.reshape(-1)
+
+    frontier = np.flatnonzero(owner > 0)
+    bridges = []
+    while len(frontier):
+        ys, xs = np.divmod(frontier, width)
+        claims = []
+        for dx, dy in STEPS:
+            near_xs, near_ys = xs + dx, ys + dy
+            inside = (near_xs >= 0) & (near_xs < width) & (near_ys >= 0) & (near_ys < height)
+            cells, near = frontier[inside], (near_xs + near_ys * width)[inside]
+
+            # Two regions meeting: the corridor goes through both cells
+            meet = (owner[near] > 0) & (owner[near] != owner[cells])
+            bridges.append(np.stack([distance[cells[meet]] + distance[near[meet]], cells[meet], near[meet]]))
+
+            free = (owner[near] == 0) & flat_walls[near] & inner[near]
+            claims.append(np.stack([near[free], cells[free]]))
+
+        # Every free wall is claimed by the first region reaching it
+        claims = np.concatenate(claims, axis=1)
+        near, first = np.unique(claims[0], return_index=True)
+        cells = claims[1][first]
+        owner[near] = owner[cells]
+        distance[near] = distance[cells] + 1
+        parent[near] = cells
+        frontier = near
+
+    # Cheapest corridor for every pair of regions, then Kruskal over them
+    bridges = np.concatenate(bridges, axis=1)
+    regions_a, regions_b = owner[bridges[1]], owner[bridges[2]]
+    pairs = np.minimum(regions_a, regions_b) * count + np.maximum(regions_a, regions_b)
+    order = np.lexsort((bridges[0], pairs))
+    _, first = np.unique(pairs[order], return_index=True)
+    bridges = bridges[:, order[first]]
+    bridges = bridges[:, np.argsort(bridges[0], kind="stable")]
+
+    roots = list(range(count))
+
+    def find(region):
+        while roots[region] != region:
+            roots[region] = roots[roots[region]]
+            region = roots[region]
+        return region
+
+    carved = flat_walls.copy()
+    for _, cell_a, cell_b in bridges.T.tolist():
+        root_a, root_b = find(owner[cell_a]), find(owner[cell_b])
+        if root_a == root_b:
+            continue
+        roots[max(root_a, root_b)] = min(root_a, root_b)
+
+        # Follow both halves of the corridor back to their regions
+        for cell in (cell_a, cell_b):
+            while cell >= 0 and carved[cell]:
+                carved[cell] = False
+                cell = parent[cell]
+
+    return carved.reshape(height, width)
+
+
+def clean_regions(walls, min_size: int = 0, connect: bool = False):
+    """
+    Function that fills the regions smaller than min_size cells and, with connect, joins the others with corridors.
+    Returns the new walls and the flat indices of the changed cells
+    """
+
+    new_walls = walls
+    if min_size > 0:
+        labels, sizes = label_regions(new_walls)
+        new_walls = fill_small_regions(new_walls, labels, sizes, min_size)
+    if connect:
+        labels, sizes = label_regions(new_walls)
+        new_walls = connect_regions(new_walls, labels, sizes)
+
+    return new_walls, np.flatnonzero(new_walls != walls)
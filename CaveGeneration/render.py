@@ -0,0 +1,136 @@
+import numpy as np
+
+import atlas
+import monsters
+import objects
+import terrain
+from config import *
+
+# Background of the map, like main.draw
+BACKGROUND = (24, 20, 37)
+
+# Opacity of the tiles when the previous map is drawn over the current one, with DEPTH
+DEPTH_ALPHA = 192 / 255
+
+# Objects drawn over the tiles, in this order
+OBJECTS = ["CHEST", "BAG", "MONSTER"]
+
+# Texture atlases already built, by scale
+atlases = {}
+
+# Textures read from the atlas, by tile id or object name
+textures = {}
+
+
+def load_texture(name):
+    """
+    Function that returns a texture as a RGBA array of floats, without needing a display
+    """
+
+    if not textures:
+        textures.update(atlas.arrays())
+
+    return textures[name].astype(np.float32) / 255
+
+
+def resize(rgba, scale: int):
+    """
+    Function that resizes a texture to scale x scale pixels: nearest pixel (like pygame.transform.scale) down to
+    half the texture size, below that the average of the covered pixels, so a 1 pixel texture is its mean colour
+    """
+
+    height, width = rgba.shape[:2]
+    if 2 * scale >= height and 2 * scale >= width:
+        return rgba[np.arange(scale) * height // scale][:, np.arange(scale) * width // scale]
+
+    # Sum the premultiplied pixels of every block, then divide by the covered alpha
+    premultiplied = np.concatenate([rgba[:, :, :3] * rgba[:, :, 3:], rgba[:, :, 3:]], axis=2)
+    rows = np.add.reduceat(premultiplied, np.arange(scale) * height // scale, axis=0)
+    blocks = np.add.reduceat(rows, np.arange(scale) * width // scale, axis=1)
+    counts = np.diff(np.append(np.arange(scale) * height // scale, height))[:, None] * \
+        np.diff(np.append(np.arange(scale) * width // scale, width))[None, :]
+
+    alpha = blocks[:, :, 3:]
+    colour = blocks[:, :, :3] / np.maximum(alpha, 1e-6)
+    return np.concatenate([colour, alpha / counts[:, :, None]], axis=2)
+
+
+def to_bytes(colours):
+    return (colours * 255 + 0.5).astype(np.uint8)
+
+
+def get_atlas(scale: int):
+    """
+    Function that builds (once for every scale) the atlas of the textures scaled to scale x scale pixels.
+    Returns the array of the tile ids to atlas rows, the tiles already drawn on the background and the objects
+    """
+
+    if scale not in atlases:
+        lookup = np.zeros(max(terrain.TILE_IDS) + 1, dtype=np.int64)
+        tiles = np.zeros((len(terrain.TILE_IDS), scale, scale, 3), dtype=np.uint8)
+        background = np.array(BACKGROUND, dtype=np.float32) / 255
+        for row, tile in enumerate(terrain.TILE_IDS):
+            lookup[tile] = row
+            rgba = resize(load_texture(tile), scale)
+            tiles[row] = to_bytes(rgba[:, :, :3] * rgba[:, :, 3:] + background * (1 - rgba[:, :, 3:]))
+
+        items = {name: resize(load_texture(name), scale) for name in OBJECTS}
+        atlases[scale] = (lookup, tiles, items)
+
+    return atlases[scale]
+
+
+def render(tile_map, chest_grid, monster_grid, width: int, height: int, scale: int = TILE_SIZE, old_tile_map=None):
+    """
+    Function that composites a map into a (height * scale, width * scale, 3) RGB array, with whole-array tile copies.
+    It does not need pygame.display, and any scale works, down to 1 pixel per cell for thumbnails
+    """
+
+    lookup, tiles, items = get_atlas(scale)
+    tile_grid = lookup[np.asarray(tile_map)].reshape(height, width)
+
+    # Every cell takes its tile from the atlas, blocks are indexed as [y, tile row, x, tile column]
+    blocks = tiles[tile_grid].transpose(0, 2, 1, 3, 4).copy()
+
+    # The previous map is drawn over it, like main.draw does with DEPTH
+    if old_tile_map is not None and len(old_tile_map):
+        old_blocks = tiles[lookup[np.asarray(old_tile_map)].reshape(height, width)].transpose(0, 2, 1, 3, 4)
+        below = np.array(BACKGROUND) * (1 - DEPTH_ALPHA) + blocks * DEPTH_ALPHA
+        blocks = to_bytes((below * (1 - DEPTH_ALPHA) + old_blocks * DEPTH_ALPHA) / 255)
+
+    cells = np.array(chest_grid, dtype=object).reshape(height, width)
+    monster_cells = np.array(monster_grid, dtype=object).reshape(height, width)
+    for name in OBJECTS:
+        ys, xs = np.nonzero((monster_cells if name == "MONSTER" else cells) == name)
+        if len(ys):
+            # Alpha blend the object over the blocks of its cells, the only pixels not copied from the atlas
+            rgba = items[name]
+            below = blocks[ys, :, xs, :] / 255
+            blocks[ys, :, xs, :] = to_bytes(rgba[:, :, :3] * rgba[:, :, 3:] + below * (1 - rgba[:, :, 3:]))
+
+    return blocks.reshape(height * scale, width * scale, 3)
+
+
+def render_map(scale: int = TILE_SIZE):
+    """
+    Function that renders the current map
+    """
+
+    old_tile_map = terrain.old_tile_map if DEPTH else None
+    return render(terrain.tile_map, objects.chest_grid, monsters.monster_grid, w, h, scale, old_tile_map)
+
+
+def save_png(path: str, image):
+    import pygame
+
+    height, width = image.shape[:2]
+    pygame.image.save(pygame.image.frombuffer(image.tobytes(), (width, height), "RGB"), path)
+
+
+def save_preview(path="output/map.png", scale: int = TILE_SIZE):
+    """
+    Function that saves a PNG of the current map without a display, e.g. scale 1 for thumbnails
+    """
+
+    save_png(path, render_map(scale))
+    print("Image saved as " + path)
@@ -0,0 +1,167 @@
+from collections import namedtuple
+
+import numpy as np
+
+# A rule compiled into a lookup table: table[state, count] is whether a cell becomes a wall, where count is the sum
+# of the kernel weights of the walls around it (out of bounds cells are walls). With box the kernel is the whole
+# (2 * radius + 1)x(2 * radius + 1) square including the cell, so the counts come from a summed-area table;
+# with totalistic both rows of the table are the same and the state of the cell can be ignored
+Rule = namedtuple("Rule", ["kernel", "table", "radius", "box", "totalistic"])
+
+# Compiled rules of the notations already seen
+compiled = {}
+
+
+def moore(radius: int = 1, centre: bool = False):
+    """
+    Function that returns the kernel of the square area up to radius cells away, with or without the cell itself
+    """
+
+    kernel = np.ones((2 * radius + 1, 2 * radius + 1), dtype=np.int64)
+    kernel[radius, radius] = centre
+    return kernel
+
+
+def von_neumann(radius: int = 1, centre: bool = False):
+    """
+    Function that returns the kernel of the diamond of cells up to radius steps away, with or without the cell itself
+    """
+
+    offsets = np.abs(np.arange(-radius, radius + 1))
+    kernel = (offsets[:, None] + offsets[None, :] <= radius).astype(np.int64)
+    kernel[radius, radius] = centre
+    return kernel
+
+
+def parse_counts(text: str):
+    # Single digits (B678), or numbers and ranges separated by commas for the wider areas (B3-5,8,10-12)
+    if "," not in text and "-" not in text:
+        return [int(digit) for digit in text]
+
+    counts = []
+    for item in filter(None, text.split(",")):
+        first, _, last = item.partition("-")
+        counts.extend(range(int(first), int(last or first) + 1))
+    return counts
+
+
+def parse(notation: str):
+    """
+    Function that reads a rule in birth/survival notation, e.g. B678/S345678: a floor cell becomes a wall with 6, 7
+    or 8 walls around it and a wall stays a wall with 3 to 8, every other cell becomes floor.
+    An optional Rn part reads the square area up to n cells away (B34-45/S33-57/R5), and a V part the diamond of
+    cells left, right, up and down (B2/S12/V). The cell itself is never counted.
+    Returns the births, the survivals and the kernel
+    """
+
+    births, survivals = None, None
+    radius, neighbourhood = 1, moore
+    for part in notation.upper().replace(" ", "").split("/"):
+        if part.startswith("B"):
+            births = parse_counts(part[1:])
+        elif part.startswith("S"):
+            survivals = parse_counts(part[1:])
+        elif part.startswith("R"):
+            radius = int(part[1:])
+        elif part.startswith("V"):
+            neighbourhood = von_neumann
+            radius = int(part[1:] or 1)
+        else:
+            raise ValueError("Unknown part " + repr(part) + " of the rule " + repr(notation))
+
+    if births is None or survivals is None:
+        raise ValueError("The rule " + repr(notation) + " needs both a B and a S part")
+
+    return births, survivals, neighbourhood(radius)
+
+
+def compile_rule(rule, kernel=None):
+    """
+    Function that compiles a rule into its lookup table. The rule is a birth/survival notation (see parse)
+    or a predicate taking the states of the cells (True for walls) and the counts of walls around them as arrays,
+    which is evaluated once for every possible state and count. kernel is the weight of every cell of the area,
+    a square array of non-negative integers centred on the cell (the Moore neighbourhood by default)
+    """
+
+    if isinstance(rule, str):
+        births, survivals, parsed_kernel = parse(rule)
+        kernel = parsed_kernel if kernel is None else kernel
+
+        def rule(states, counts):
+            return np.where(states, np.isin(counts, survivals), np.isin(counts, births))
+
+    kernel = moore() if kernel is None else np.asarray(kernel, dtype=np.int64)
+    size = kernel.shape[0]
+    if kernel.ndim != 2 or size != kernel.shape[1] or size % 2 == 0:
+        raise ValueError("The kernel must be a square with an odd side")
+    if (kernel < 0).any():
+        raise ValueError("The kernel weights cannot be negative")
+
+    radius = size // 2
+    states, counts = np.meshgrid([False, True], np.arange(kernel.sum() + 1), indexing="ij")
+    table = np.broadcast_to(np.asarray(rule(states, counts), dtype=bool), states.shape).copy()
+
+    # A square area without the cell is a square area with it, counting the cell once more when it is a wall
+    outer = moore(radius)
+    if np.array_equal(kernel, outer):
+        kernel = moore(radius, True)
+        box_table = np.zeros((2, size * size + 1), dtype=bool)
+        box_table[0, :-1] = table[0]
+        box_table[1, 1:] = table[1]
+        # A floor cell never counts all the area, nor a wall none of it: copied from the other row, so the table
+        # of a rule like B5678/S45678 is totalistic
+        box_table[0, -1], box_table[1, 0] = box_table[1, -1], box_table[0, 0]
+        table = box_table
+
+    box = bool((kernel == 1).all())
+    return Rule(kernel, table, radius, box, bool(np.array_equal(table[0], table[1])))
+
+
+# The rules of the terrain, counting the walls in a square area including the cell itself
+PRESETS = {
+    # Rule 1: A cell becomes solid if it has 5 or more solid neighbors (B5678/S45678)
+    1: compile_rule(lambda states, counts: counts >= 5, moore(1, True)),
+    # Rule 2: A cell becomes solid if it has exactly 5 solid neighbors (B5/S4)
+    2: compile_rule(lambda states, counts: counts == 5, moore(1, True)),
+    # Rule 3: A cell becomes solid if it has 3 or more solid neighbors in a 11x11 area
+    3: compile_rule(lambda states, counts: counts >= 3, moore(5, True)),
+    # Rule 4: A cell becomes solid if it has at least 2 solid neighbors in a 7x7 area
+    4: compile_rule(lambda states, counts: counts >= 2, moore(3, True)),
+    # Rule 5: A cell becomes solid if it has more than 6 solid neighbors (B78/S678)
+    5: compile_rule(lambda states, counts: counts > 6, moore(1, True)),
+    # Rule 6: A cell becomes solid if it has fewer than 2 solid neighbors (B01/S0)
+    6: compile_rule(lambda states, counts: counts < 2, moore(1, True)),
+    # Rule 7: A cell becomes solid if it has an even number of solid neighbors (B02468/S1357)
+    7: compile_rule(lambda states, counts: counts % 2 == 0, moore(1, True)),
+    # Rule 8: A cell becomes solid if it has a prime number of solid neighbors (B2357/S1246)
+    8: compile_rule(lambda states, counts: np.isin(counts, [2, 3, 5, 7]), moore(1, True)),
+}
+
+# Unknown rules never create walls
+NO_WALLS = compile_rule(lambda states, counts: np.zeros(counts.shape, dtype=bool), moore(1, True))
+
+
+def get_rule(rule):
+    """
+    Function that returns the compiled rule of a preset number, a birth/survival notation or an already compiled rule.
+    Every notation is compiled only once
+    """
+
+    if isinstance(rule, Rule):
+        return rule
+    if isinstance(rule, str):
+        if rule not in compiled:
+            compiled[rule] = compile_rule(rule)
+        return compiled[rule]
+
+    return PRESETS.get(rule, NO_WALLS)
+
+
+def lookup(rule: Rule, states, counts):
+    """
+    Function that returns the new states of the cells from their states and the counts of walls around them
+    """
+
+    if rule.totalistic:
+        return rule.table[0][counts]
+    return rule.table.reshape(-1)[counts + states * rule.table.shape[1]]
@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+import tracemalloc
+
+from config import *
+
+# Recording is off unless STATS is set or enable() is called, then every phase costs one check
+enabled = STATS
+memory = STATS_MEMORY
+
+# Records of every phase by name, phases run on the window and on the generation worker threads
+phases = {}
+lock = threading.Lock()
+
+# The peak memory is the same for all the threads, so only one phase at a time measures it
+memory_lock = threading.Lock()
+
+
+class Phase:
+    """
+    Context manager measuring the wall time, the cells touched and the memory allocated by one phase.
+    Set cells inside the with block, e.g. the number of cells changed by the phase.
+    While a phase of another thread is measuring the memory, the memory of this one is not measured
+    """
+
+    __slots__ = ["name", "cells", "start", "memory_start", "tracking"]
+
+    def __init__(self, name: str):
+        self.name = name
+        self.cells = 0
+        self.tracking = False
+
+    def __enter__(self):
+        if memory and memory_lock.acquire(blocking=False):
+            self.tracking = True
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        allocated = None
+        if self.tracking:
+            allocated = tracemalloc.get_traced_memory()[1] - self.memory_start
+            self.tracking = False
+            memory_lock.release()
+        record(self.name, seconds, self.cells, allocated if memory else 0)
+        return False
+
+
+class NoPhase:
+    # Phase used while recording is off, it does nothing
+    __slots__ = ["cells"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+no_phase = NoPhase()
+
+
+def phase(name: str):
+    """
+    Function that returns the context manager measuring the phase name, e.g.
+        with stats.phase("step") as p:
+            terrain.iterate_once()
+            p.cells = len(terrain.changed_cells)
+    """
+
+    if not enabled:
+        return no_phase
+    return Phase(name)
+
+
+def record(name: str, seconds: float, cells: int = 0, allocated=0):
+    # allocated is None when the memory was not measured, the last measure is kept
+    with lock:
+        if name not in phases:
+            phases[name] = {"calls": 0, "seconds": 0.0, "total": 0.0, "max": 0.0, "cells": 0, "allocated": 0}
+
+        stats = phases[name]
+        stats["calls"] += 1
+        stats["seconds"] = seconds
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+        stats["cells"] = int(cells)
+        if allocated is not None:
+            stats["allocated"] = allocated
+
+
+def enable(track_memory: bool = STATS_MEMORY):
+    """
+    Function that starts recording the phases, tracking the peak memory they allocate if track_memory is set
+    """
+
+    global enabled, memory
+    enabled = True
+    memory = track_memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global enabled, memory
+    enabled = False
+    if memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    memory = False
+
+
+def reset():
+    with lock:
+        phases.clear()
+
+
+def get_stats():
+    """
+    Function that returns a copy of the records of every phase: the last wall time (seconds), total and max seconds,
+    calls, mean seconds, cells touched and bytes allocated by the last call
+    """
+
+    with lock:
+        return {name: dict(stats, mean=stats["total"] / stats["calls"]) for name, stats in phases.items()}
+
+
+def summary():
+    # One short line for every phase, for the side panel
+    lines = []
+    with lock:
+        records = [(name, dict(stats)) for name, stats in phases.items()]
+
+    for name, stats in records:
+        line = name + " " + format(stats["seconds"] * 1000, ".1f") + " ms " + str(stats["cells"])
+        if memory:
+            line += " " + str(stats["allocated"] // 1024) + " KB"
+        lines.append(line)
+
+    return lines
+
+
+def save_stats_to_json(path="output/stats.json"):
+    with open(path, "w") as f:
+        json.dump(get_stats(), f, indent=4)
+    print("Saved stats to " + path)
+
+
+if enabled and memory:
+    tracemalloc.start()
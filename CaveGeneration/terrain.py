@@ -1,6 +1,16 @@
-import pygame
+import multiprocessing
 import random
+from collections import deque, namedtuple
 
+import numpy as np
+
+import autotile
+import automaton
+import bitboard
+import multires
+import parallel
+import regions
+import rules
 from config import *
 
 # Initialize tiles and tile map
@@ -8,146 +18,148 @@ tiles = []
 tile_map = []
 old_tile_map = []
 
-# Load textures
-tile_set = {}
-alpha = 255
+# Summed-area table of the tiles, only valid while the tiles are not changing
+wall_table = None
+
+# Grid stepped in place by the INCREMENTAL engine and the tiles list it mirrors
+frontier_grid = None
+frontier_tiles = None
+# Boards stepped by the BITBOARD engine, the current one and the one the next generation is written into, kept
+# packed between iteractions like frontier_grid, and the tiles list they mirror
+board = None
+back_board = None
+board_tiles = None
+# Cells changed by the last iteraction of the INCREMENTAL engine, kept apart from changed_cells, which other functions
+# (e.g. clean_regions) also set to tell which tiles to rebuild
+frontier_cells = None
+# Flat indices of the cells changed by the last iteraction, None when every cell may have changed
+changed_cells = None
+
+# Incremented every time the tile map changes, so caches built on it know when they are stale
+map_version = 0
+
+# Random keys of the cells, xor of the keys of the walls is the hash of a generation
+hash_keys = None
+
+# Result of run_until_stable, period is 1 for a fixed point, n for a cycle of n generations, 0 if not settled
+Stability = namedtuple("Stability", ["iterations", "period"])
+
+# Tiles with a texture
+TILE_IDS = [GROUND_BONES, GROUND_STONE, GROUND, VOID, ISOLATED, CON_U, CON_U2, CON_U3, CON_U4, CON_D, CON_D2,
+            CON_D3, CON_D4, CON_D5, CON_L, CON_L2, CON_L3, CON_L4, CON_L5, CON_L6, CON_R, CON_R2, CON_R3, CON_R4,
+            CON_R5, CON_LR, CON_LR2, CON_LR3, CON_LR4, CON_LR5, CON_LR6, CON_LR7, CON_LR8, CON_UD, CON_UD2,
+            CON_UD3, CON_UD4, CON_UD5, CON_UD6, CON_UR, CON_UL, CON_DR, CON_DL, CON_LUR, CON_LDR, CON_LUD,
+            CON_URD, CON_LURD]
+
+
+def setup(tile: bool = True):
+    """
+    Function that fills the terrain with random walls and builds its tile map.
+    Without tile the tile map is left empty, for callers changing the tiles before building it once
+    """
+
+    global tiles, changed_cells
+    tiles = []
+    changed_cells = None
 
+    for j in range(h):
+        for i in range(w):
+            # Ensure tiles at the margins are always walls
+            if i == 0 or i == w - 1 or j == 0 or j == h - 1:
+                tiles.append(True)  # Solid (wall)
+            else:
+                solid = random.random() < INITIAL_PROB
+                tiles.append(solid)
+    if tile:
+        to_tile_set()
+    else:
+        clear_tile_set()
 
-def preload():
-    # Load tiles
-    tile_list = [GROUND_BONES, GROUND_STONE, GROUND, VOID, ISOLATED, CON_U, CON_U2, CON_U3, CON_U4, CON_D, CON_D2,
-                 CON_D3, CON_D4, CON_D5, CON_L, CON_L2, CON_L3, CON_L4, CON_L5, CON_L6, CON_R, CON_R2, CON_R3, CON_R4,
-                 CON_R5, CON_LR, CON_LR2, CON_LR3, CON_LR4, CON_LR5, CON_LR6, CON_LR7, CON_LR8, CON_UD, CON_UD2,
-                 CON_UD3, CON_UD4, CON_UD5, CON_UD6, CON_UR, CON_UL, CON_DR, CON_DL, CON_LUR, CON_LDR, CON_LUD,
-                 CON_URD, CON_LURD]
 
-    for tile in tile_list:
-        load_tiles(tile)
+def setup_levels(levels: int = LEVELS, tile: bool = True):
+    """
+    Function that fills the terrain with caves generated coarse to fine (see multires.py) and builds its tile map,
+    or leaves it empty without tile like setup. Returns the report of every level
+    """
 
-    # Objects
-    # Load chest texture
-    tile_set["CHEST"] = pygame.image.load("textures/chest.png")
-    tile_set["BAG"] = pygame.image.load("textures/bag.png")
+    global tiles, changed_cells
+    rng = np.random.default_rng(random.getrandbits(64))
+    grid, report = multires.generate(w, h, rng, RULE, INITIAL_PROB, levels)
+    tiles = automaton.from_array(grid)
+    changed_cells = None
+    if tile:
+        to_tile_set()
+    else:
+        clear_tile_set()
 
-    # Monsters
-    # Load monster texture
-    tile_set["MONSTER"] = pygame.image.load("textures/monster.png")
+    return report
 
 
-def load_tiles(tile_name: str):
-    global alpha
-    tile_set[tile_name] = pygame.image.load("textures/Tile_" + str(tile_name) + ".png").convert_alpha()
-    # Alpha can be modified for future implementations
-    if DEPTH:
-        alpha = 192
+def to_tile_set(cells=None):
+    """
+    Function that builds the tile map from the tiles, in one pass over the whole grid.
+    When cells (flat indices changed since the last call) are given, only the area around them is rebuilt
+    """
 
-    tile_set[tile_name].set_alpha(alpha)
+    global tile_map, old_tile_map, map_version
+    map_version += 1
 
+    # Random textures are drawn in bulk, from a generator seeded by the random module
+    rng = np.random.default_rng(random.getrandbits(64))
 
-def to_tile_set():
-    global tile_map, old_tile_map
+    # Rebuilding around many changed cells costs more than rebuilding everything
+    if cells is not None and len(tile_map) == w * h and len(cells) * 25 < w * h:
+        update_tile_set(cells, rng)
+        return
 
     if DEPTH:
         old_tile_map = tile_map
 
+    tile_map = autotile.build_tile_map(tiles_array(), rng, COUNT_MODE)
+
+
+def clear_tile_set():
+    # The tile map of the old tiles would be stale, and so the previous one shown with DEPTH
+    global tile_map, old_tile_map, map_version
+    map_version += 1
     tile_map = []
-    for j in range(h):
-        for i in range(w):
-            # Ensure border cells are walls or VOID
-            if i == 0 or i == w - 1 or j == 0 or j == h - 1:
-                # Border cells are always walls or VOID
-                if num_walls_around(i, j) == 9:
-                    tile_map.append(VOID)
-                else:
-                    tile_map.append(ISOLATED)
-            else:
-                solid = is_solid(i, j)
-                if solid:
-                    # Check if the cell is completely surrounded by walls (VOID)
-                    if num_walls_around(i, j) == 9:
-                        tile_map.append(VOID)
-                    else:
-                        # Assign a general wall type (e.g., ISOLATED) during initial generation
-                        tile_map.append(ISOLATED)
-                else:
-                    if random.random() < 0.05:
-                        if random.random() < 0.5:
-                            tile_map.append(GROUND_STONE)
-                        else:
-                            tile_map.append(GROUND_BONES)
-                    else:
-                        tile_map.append(GROUND)
-
-    # After generating the tile map, analyze and update wall types
-    update_sprites()
-
-
-def update_sprites():
-    for j in range(h):
-        for i in range(w):
-            if is_wall(i, j):
-                coord = i + j * w
-                # If not is at the margins
-                if not (i == 0 or i == w - 1 or j == 0 or j == h - 1):
-                    left = is_wall(i - 1, j)  # Left cell
-                    right = is_wall(i + 1, j)  # Right cell
-                    up = is_wall(i, j - 1)  # Up cell
-                    down = is_wall(i, j + 1)  # Down cell
-
-                    set_wall_type(coord, left, right, up, down)
-
-                else:
-                    # Cell is at margin
-                    if i == 0 and j == 0:
-                        # left up
-                        right = is_wall(i + 1, j)  # Right cell
-                        down = is_wall(i, j + 1)  # Down cell
-                        set_wall_type(coord, False, right, False, down)
-                    elif i == w - 1 and j == 0:
-                        # right up
-                        left = is_wall(i - 1, j)  # Left cell
-                        down = is_wall(i, j + 1)  # Down cell
-                        set_wall_type(coord, left, False, False, down)
-                    elif i == 0 and j == h - 1:
-                        # left down
-                        right = is_wall(i + 1, j)  # Right cell
-                        up = is_wall(i, j - 1)  # Up cell
-                        set_wall_type(coord, False, right, up, False)
-                    elif i == w - 1 and j == h - 1:
-                        # right down
-                        left = is_wall(i - 1, j)  # Left cell
-                        up = is_wall(i, j - 1)  # Up cell
-                        set_wall_type(coord, left, False, up, False)
-                    else:
-
-                        # One margin
-                        if i == 0:
-                            # left most
-                            right = is_wall(i + 1, j)  # Right cell
-                            up = is_wall(i, j - 1)  # Up cell
-                            down = is_wall(i, j + 1)  # Down cell
-                            set_wall_type(coord, False, right, up, down)
-
-                        elif i == w - 1:
-                            # right most
-                            left = is_wall(i - 1, j)  # Left cell
-                            up = is_wall(i, j - 1)  # Up cell
-                            down = is_wall(i, j + 1)  # Down cell
-                            set_wall_type(coord, left, False, up, down)
-
-                        elif j == 0:
-                            # top most
-                            left = is_wall(i - 1, j)  # Left cell
-                            right = is_wall(i + 1, j)  # Right cell
-                            down = is_wall(i, j + 1)  # Down cell
-                            set_wall_type(coord, left, right, False, down)
-
-                        elif j == h - 1:
-                            # down most
-                            left = is_wall(i - 1, j)  # Left cell
-                            right = is_wall(i + 1, j)  # Right cell
-                            up = is_wall(i, j - 1)  # Up cell
-                            set_wall_type(coord, left, right, up, False)
+    old_tile_map = []
+
+
+def update_tile_set(cells, rng):
+    """
+    Function that rebuilds the tile map only around the changed cells, keeping the ground textures of the others
+    """
+
+    global old_tile_map
+
+    if DEPTH:
+        old_tile_map = tile_map.copy()
+
+    autotile.update_tile_map(tile_map, tiles_array(), cells, rng)
+
+
+def update_sprites(coords=None, rng=None):
+    """
+    Function that gives every wall (or the walls among coords) the texture connecting it to the walls around,
+    looking up the mask of the connected walls in autotile.WALL_TABLE
+    """
+
+    if rng is None:
+        rng = np.random.default_rng(random.getrandbits(64))
+
+    tile_grid = tile_map.reshape(h, w)
+    if coords is None:
+        tile_map[:] = autotile.connect_walls(tile_grid, rng).reshape(-1)
+    else:
+        tile_map[coords] = autotile.connect_cells(tile_grid, coords, rng)
+
+
+def tiles_array():
+    # The INCREMENTAL engine already keeps the tiles as an array
+    if frontier_tiles is tiles:
+        return frontier_grid
+    return automaton.to_array(tiles, w, h)
 
 
 def is_wall(i, j):
@@ -167,128 +179,248 @@ def is_solid(x, y):
         return False
 
 
-def set_wall_type(coord, left, right, up, down):
-    # Full connected
-    if left and right and up and down:
-        tile_map[coord] = CON_LURD
-    else:
-        # Three connected
-        if left and right and up:
-            tile_map[coord] = CON_URD
-        elif left and right and down:
-            tile_map[coord] = CON_LDR
-        elif up and right and down:
-            tile_map[coord] = CON_URD
-        elif up and left and down:
-            tile_map[coord] = CON_LUD
-        else:
-            # Corners
-            if left and up:
-                tile_map[coord] = CON_UL
-            elif left and down:
-                tile_map[coord] = CON_DL
-            elif right and down:
-                tile_map[coord] = CON_DR
-            elif right and up:
-                tile_map[coord] = CON_UR
-            else:
-                # Two connected
-                if left and right:
-                    tile_map[coord] = random.choice(LR_LIST)
-                elif up and down:
-                    tile_map[coord] = random.choice(UD_LIST)
-                else:
-                    # One connected
-                    if left:
-                        tile_map[coord] = random.choice(L_LIST)
-                    elif right:
-                        tile_map[coord] = random.choice(R_LIST)
-                    elif up:
-                        tile_map[coord] = random.choice(U_LIST)
-                    elif down:
-                        tile_map[coord] = random.choice(D_LIST)
-
-
 def iterate_tiles():
     """
     Function that make an iteraction for all the terrain cells
     """
 
-    global tiles
+    global tiles, changed_cells
+    if ENGINE == "INCREMENTAL":
+        iterate_changed_tiles()
+        return
+
+    if ENGINE == "PARALLEL" and parallel_allowed():
+        iterate_tiles_parallel()
+        return
+    elif ENGINE in ("NUMPY", "PARALLEL"):
+        # Compute the whole grid at once, also for the PARALLEL engine where it cannot start its processes
+        grid = automaton.to_array(tiles, w, h)
+        new_grid = automaton.step(grid, RULE, COUNT_MODE)
+        changed_cells = np.flatnonzero(new_grid != grid)
+        tiles = automaton.from_array(new_grid)
+        return
+    elif ENGINE == "BITBOARD":
+        iterate_board()
+        return
+
+    build_wall_table()
     new_tiles = []
+    changed = []
     for j in range(h):
         for i in range(w):
             # Add the new tile to the grid
             new_tiles.append(iterate(i, j))
+            if bool(new_tiles[-1]) != bool(tiles[i + j * w]):
+                changed.append(i + j * w)
+    clear_wall_table()
 
     tiles = new_tiles
+    changed_cells = np.array(changed, dtype=np.int64)
+
+
+def iterate_board():
+    """
+    Function that make an iteraction computing 64 cells for every word operation, on a board kept packed
+    between the iteractions
+    """
+
+    global board, back_board, board_tiles, changed_cells
+
+    if tiles is not board_tiles:
+        # The tiles were replaced, so they have to be packed again
+        board = bitboard.pack(tiles, w, h)
+        back_board = np.empty_like(board)
+        board_tiles = tiles
+
+    bitboard.step(board, w, RULE, out=back_board)
+    changed_cells = bitboard.changed_cells(board, back_board, w)
+    board, back_board = back_board, board
+
+    # Flip only the changed tiles, without building a new list
+    for coord in changed_cells.tolist():
+        tiles[coord] = not tiles[coord]
+
+
+def parallel_allowed():
+    # Daemonic processes (e.g. the workers of batch.py) are not allowed to start the processes of the PARALLEL engine
+    return not multiprocessing.current_process().daemon
+
+
+def iterate_tiles_parallel(iterations: int = 1):
+    """
+    Function that makes at most iterations iteractions computing horizontal stripes of the grid in parallel processes,
+    started only once for all of them, stopping as soon as an iteraction changes nothing.
+    Returns the iteractions made and whether the last one changed nothing
+    """
+
+    global tiles, changed_cells
+
+    grid = automaton.to_array(tiles, w, h)
+    new_grid, done, last_changes = parallel.run(grid, RULE, iterations, WORKERS, until_stable=True)
+    changed_cells = np.flatnonzero(new_grid != grid)
+    tiles = automaton.from_array(new_grid)
+
+    return done, last_changes == 0
+
+
+def cycle_period(limit: int):
+    """
+    Function that returns the smallest number of iteractions, at most limit, after which the tiles repeat
+    """
+
+    grid = automaton.to_array(tiles, w, h)
+    new_grid = grid
+    for period in range(1, limit):
+        new_grid = automaton.step(new_grid, RULE, COUNT_MODE)
+        if np.array_equal(new_grid, grid):
+            return period
+    return limit
 
 
 def iterate_tiles_randomly():
     """
-    Function that make an iteraction for all the terrain cells in random order
+    Function that make an asynchronous iteraction: the terrain cells are updated in place in random order,
+    every one reading the cells updated before it, with the configured ASYNC_SCHEDULE
     """
 
-    global tiles
-    new_tiles = []
+    global tiles, changed_cells
+
+    grid = automaton.to_array(tiles, w, h).copy()
+    rng = np.random.default_rng(random.getrandbits(64))
+    changed_cells = automaton.step_async(grid, RULE, rng, ASYNC_SCHEDULE)
+    tiles = automaton.from_array(grid)  # Update the tiles
+
+
+def iterate_once():
+    """
+    Function that make an iteraction with the configured UPDATE_MODE
+    """
+
+    if UPDATE_MODE == "RANDOM":
+        iterate_tiles_randomly()
+    else:
+        iterate_tiles()
+
+
+def run_until_stable(max_iters: int, window: int = CYCLE_WINDOW):
+    """
+    Function that iterates until the tiles stop changing or repeat one of the last window generations,
+    at most max_iters times. Changes are tracked by the iteractions themselves, so every check costs O(changed cells)
+    """
+
+    global hash_keys
+    if hash_keys is None or len(hash_keys) != w * h:
+        hash_keys = automaton.hash_keys(w * h)
+
+    # Hash of the current generation, then updated only with the changed cells
+    generation_hash = automaton.grid_hash(hash_keys, automaton.to_array(tiles, w, h).ravel())
+    seen = {generation_hash: 0}
+    history = deque([generation_hash])
+
+    # The PARALLEL engine starts its processes once for a batch of window iteractions, of which only the last
+    # generation is compared: fixed points are found at the same iteraction, cycles up to a batch later
+    batched = UPDATE_MODE != "RANDOM" and ENGINE == "PARALLEL" and parallel_allowed()
+
+    iteration = 0
+    while iteration < max_iters:
+        if batched:
+            done, stable = iterate_tiles_parallel(min(window, max_iters - iteration))
+            iteration += done
+        else:
+            iterate_once()
+            iteration += 1
+            stable = len(changed_cells) == 0
+        if stable:
+            return Stability(iteration, 1)
 
-    # Create a list of all cell coordinates
-    cell_coords = [(i, j) for j in range(h) for i in range(w)]
-    random.shuffle(cell_coords)  # Shuffle the list
+        generation_hash ^= automaton.grid_hash(hash_keys, changed_cells)
+        if generation_hash in seen:
+            period = iteration - seen[generation_hash]
+            # The generations between the compared ones may repeat sooner
+            return Stability(iteration, cycle_period(period) if batched else period)
 
-    for i, j in cell_coords:
-        # Add the new tile to the grid
-        new_tiles.append(iterate(i, j))
+        seen[generation_hash] = iteration
+        history.append(generation_hash)
+        if len(history) > window:
+            del seen[history.popleft()]
 
-    tiles = new_tiles  # Update the tiles
+    return Stability(max_iters, 0)
+
+
+def clean_regions(min_size: int = MIN_REGION_SIZE, connect: bool = CONNECT_REGIONS):
+    """
+    Function that fills the caves smaller than min_size cells and, with connect, carves corridors joining the others.
+    Sets changed_cells, so to_tile_set(changed_cells) rebuilds the tile map only around them
+    """
+
+    global tiles, changed_cells
+    walls, changed_cells = regions.clean_regions(tiles_array(), min_size, connect)
+    if len(changed_cells):
+        tiles = automaton.from_array(walls)
+
+
+def iterate_changed_tiles():
+    """
+    Function that make an iteraction only for the cells near the ones changed by the previous iteraction
+    """
+
+    global frontier_grid, frontier_tiles, frontier_cells, changed_cells
+
+    if tiles is not frontier_tiles:
+        # The tiles were replaced, so every cell has to be computed
+        frontier_grid = automaton.to_array(tiles, w, h)
+        frontier_tiles = tiles
+        frontier_cells = None
+
+    frontier_cells = automaton.step_frontier(frontier_grid, frontier_cells, RULE, COUNT_MODE)
+    changed_cells = frontier_cells
+
+    # Flip only the changed tiles, without building a new list
+    for coord in changed_cells.tolist():
+        tiles[coord] = not tiles[coord]
 
 
 def iterate(i: int, j: int):
     """
-    Function that actually calculate the state for the cells
+    Function that actually calculate the state for the cells, reading the table of the compiled RULE
     """
 
-    new_tile = []
     # Ensure tiles at the margins remain walls
     if i == 0 or i == w - 1 or j == 0 or j == h - 1:
         return True  # Solid (wall)
+
+    rule = rules.get_rule(RULE)
+    if rule.box:
+        num = num_walls_in_area(i, j, rule.radius)
     else:
-        if RULE == 1:
-            # Rule 1: A cell becomes solid if it has 5 or more solid neighbors
-            num = num_walls_around(i, j)
-            new_tile = num >= 5
-        elif RULE == 2:
-            # Rule 2: A cell becomes solid if it has exactly 5 solid neighbors
-            num = num_walls_around(i, j)
-            new_tile = num == 5
-        elif RULE == 3:
-            # Rule 3: A cell becomes solid if it has 3 or more solid neighbors in a 5x5 area
-            new_tile = num_walls_in_area(i, j, 5) >= 3
-        elif RULE == 4:
-            # Rule 4: A cell becomes solid if it has at least 2 solid neighbors in a 3x3 area
-            new_tile = num_walls_in_area(i, j, 3) >= 2
-        elif RULE == 5:
-            # Rule 5: A cell becomes solid if it has more than 6 solid neighbors
-            num = num_walls_around(i, j)
-            new_tile = num > 6
-        elif RULE == 6:
-            # Rule 6: A cell becomes solid if it has fewer than 2 solid neighbors
-            num = num_walls_around(i, j)
-            new_tile = num < 2
-        elif RULE == 7:
-            # Rule 7: A cell becomes solid if it has an even number of solid neighbors
-            num = num_walls_around(i, j)
-            new_tile = num % 2 == 0
-        elif RULE == 8:
-            # Rule 8: A cell becomes solid if it has a prime number of solid neighbors
-            # Better results with 3 and 5
-            num = num_walls_around(i, j)
-            new_tile = num in [2, 3, 5, 7]
-
-        return new_tile
+        num = 0
+        for dy, dx in zip(*np.nonzero(rule.kernel)):
+            if is_solid(i + dx - rule.radius, j + dy - rule.radius):
+                num += int(rule.kernel[dy, dx])
+
+    return bool(rule.table[int(bool(tiles[i + j * w])), num])
+
+
+def build_wall_table():
+    """
+    Function that builds the summed-area table of the current tiles, so every area count costs O(1)
+    """
+
+    global wall_table
+    if COUNT_MODE == "SAT":
+        wall_table = automaton.integral_image(automaton.to_array(tiles, w, h))
+
+
+def clear_wall_table():
+    # The tiles are going to change, so the table is no longer valid
+    global wall_table
+    wall_table = None
 
 
 def num_walls_around(x, y):
+    if wall_table is not None:
+        return automaton.area_count(wall_table, x, y, 1)
+
     num = 0
     for i in range(-1, 2):
         for j in range(-1, 2):
@@ -298,6 +430,9 @@ def num_walls_around(x, y):
 
 
 def num_walls_in_area(x, y, radius):
+    if wall_table is not None:
+        return automaton.area_count(wall_table, x, y, radius)
+
     count = 0
     for i in range(x - radius, x + radius + 1):
         for j in range(y - radius, y + radius + 1):
@@ -308,11 +443,4 @@ def num_walls_in_area(x, y, radius):
 
 def wall_count():
     # Count how much walls there are
-    wall_count = 0
-
-    for j in range(h):
-        for i in range(w):
-            if is_wall(i, j):
-                wall_count += 1
-
-    return wall_count
+    return int(np.count_nonzero(autotile.is_wall(tile_map)))
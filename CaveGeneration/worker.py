@@ -0,0 +1,145 @@
+import queue
+import threading
+import traceback
+
+import numpy as np
+
+import monsters
+import objects
+import render
+import stats
+import terrain
+from config import *
+
+# Commands of the worker, any other callable is just run on the worker thread (e.g. saving the map)
+STEP = "STEP"
+CLEAN = "CLEAN"
+
+
+class GenerationWorker(threading.Thread):
+    """
+    Thread doing all the work on the terrain, objects and monsters modules, so the window never waits for it.
+    Commands are queued with request(), and a snapshot of the map (tile map, chests, monsters and the image of the map)
+    is queued into results after every batch of them. All the STEP commands queued while the worker was busy are run
+    as one batch, and only the last generation is placed and published.
+    A command raising an exception is reported in the snapshot (error) and the worker goes on with the next ones
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+
+    def request(self, command):
+        self.requests.put(command)
+
+    def stop(self):
+        self.requests.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            commands = [self.requests.get()]
+            # Take every command queued meanwhile
+            while True:
+                try:
+                    commands.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in commands
+            commands = commands[:commands.index(None)] if stop else commands
+
+            stable = None
+            error = None
+            steps = 0
+            for n, command in enumerate(commands):
+                try:
+                    if command == STEP:
+                        steps += 1
+                        # Consecutive steps are coalesced, they are run when the next command is not a step
+                        if n + 1 < len(commands) and commands[n + 1] == STEP:
+                            continue
+                        count, steps = steps, 0
+                        stable = self.step(count)
+                    elif command == CLEAN:
+                        self.clean()
+                    else:
+                        command()
+                except Exception as exception:
+                    traceback.print_exc()
+                    error = repr(exception)
+
+            try:
+                result = self.snapshot(len(commands), stable)
+            except Exception as exception:
+                traceback.print_exc()
+                result = {"done": len(commands), "stable": None}
+                error = repr(exception)
+            result["error"] = error
+            self.results.put(result)
+            if stop:
+                return
+
+    def step(self, count: int):
+        """
+        Function that makes count iteractions, then re-tiles around every cell they changed and places the objects.
+        Returns whether the walls are stable
+        """
+
+        changed = []
+        with stats.phase("step") as phase:
+            for _ in range(count):
+                terrain.iterate_once()
+                changed.append(terrain.changed_cells)
+            # Cells changed back and forth still need their tiles rebuilt
+            changed_cells = np.unique(np.concatenate(changed))
+            phase.cells = len(changed_cells)
+
+        with stats.phase("autotile") as phase:
+            terrain.to_tile_set(changed_cells)
+            phase.cells = len(changed_cells)
+
+        self.place()
+
+        # The iteraction tracks its own changes, no need to count the walls
+        return len(terrain.changed_cells) == 0
+
+    def clean(self):
+        # Fill the small caves and connect the others, re-tiling only around the changed cells
+        terrain.clean_regions(max(MIN_REGION_SIZE, 1), True)
+        terrain.to_tile_set(terrain.changed_cells)
+        self.place()
+
+    def place(self):
+        with stats.phase("chests") as phase:
+            chest_grid = objects.place_chests()
+            if stats.enabled:
+                phase.cells = w * h - chest_grid.count(False)
+
+        with stats.phase("monsters") as phase:
+            monster_grid = monsters.place_monsters(chest_grid)
+            if stats.enabled:
+                phase.cells = w * h - monster_grid.count(False)
+
+    def snapshot(self, done: int, stable):
+        """
+        Function that copies the map for the window, which keeps drawing it while the worker changes the modules.
+        done is the number of commands handled, stable is None when no step was made.
+        The image is composed here, so the window only has to wrap it into a surface
+        """
+
+        old_tile_map = np.array(terrain.old_tile_map, dtype=np.int32)
+        chest_grid = list(objects.chest_grid)
+        monster_grid = list(monsters.monster_grid)
+
+        return {
+            "done": done,
+            "stable": stable,
+            "tile_map": terrain.tile_map.copy(),
+            "old_tile_map": old_tile_map,
+            "chest_grid": chest_grid,
+            "monster_grid": monster_grid,
+            "image": render.render(terrain.tile_map, chest_grid, monster_grid, w, h, TILE_SIZE,
+                                   old_tile_map if DEPTH else None),
+        }
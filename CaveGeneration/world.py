@@ -0,0 +1,147 @@
+import random
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+import automaton
+import autotile
+import monsters
+import objects
+import rules
+from config import *
+
+
+def chunk_seed(world_seed: int, cx: int, cy: int):
+    """
+    Function that derives the seed of a chunk from the world seed and the chunk coordinates
+    """
+
+    return random.Random(str(world_seed) + ":" + str(cx) + ":" + str(cy)).getrandbits(64)
+
+
+class ChunkWorld:
+    """
+    Infinite world generated on demand, one chunk of chunk_size x chunk_size cells at a time.
+    Every chunk is stepped together with a halo of its neighbours' cells, so the caves join up across the chunk edges,
+    and the finished chunks are kept in a LRU cache holding at most cache_mb megabytes
+    """
+
+    def __init__(self, seed: int, chunk_size=CHUNK_SIZE, iterations=CHUNK_ITERATIONS, cache_mb=CHUNK_CACHE_MB,
+                 rule=RULE):
+        # Cells reached by the iteractions, plus the 2 cells read to choose the textures at the chunk edges
+        self.halo = iterations * rules.get_rule(rule).radius + 2
+        if self.halo > chunk_size:
+            raise ValueError("Chunks of " + str(chunk_size) + " cells are smaller than their halo of " +
+                             str(self.halo) + " cells")
+
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.iterations = iterations
+        self.rule = rule
+        self.cache_bytes = cache_mb * 1024 * 1024
+
+        self.chunks = OrderedDict()
+        self.used_bytes = 0
+
+    def get_chunk(self, cx: int, cy: int):
+        """
+        Function that returns the chunk at the chunk coordinates, generating it if it is not cached
+        """
+
+        key = (cx, cy)
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+
+        chunk = self.generate(cx, cy)
+        self.chunks[key] = chunk
+        self.used_bytes += chunk["bytes"]
+
+        # Drop the least recently used chunks, always keeping the new one
+        while self.used_bytes > self.cache_bytes and len(self.chunks) > 1:
+            _, old_chunk = self.chunks.popitem(last=False)
+            self.used_bytes -= old_chunk["bytes"]
+
+        return chunk
+
+    def chunks_around(self, x: int, y: int, distance: int = 1):
+        """
+        Function that returns the chunks up to distance chunks away from the cell (x, y), e.g. around the player
+        """
+
+        cx, cy = x // self.chunk_size, y // self.chunk_size
+
+        return [self.get_chunk(cx + dx, cy + dy)
+                for dy in range(-distance, distance + 1) for dx in range(-distance, distance + 1)]
+
+    def tile_at(self, x: int, y: int):
+        cx, i = divmod(x, self.chunk_size)
+        cy, j = divmod(y, self.chunk_size)
+
+        return self.get_chunk(cx, cy)["tile_map"][i + j * self.chunk_size]
+
+    def noise(self, cx: int, cy: int):
+        # Initial walls of a chunk, the same whichever chunk asks for them
+        rng = np.random.default_rng(chunk_seed(self.seed, cx, cy))
+        return rng.random((self.chunk_size, self.chunk_size)) < INITIAL_PROB
+
+    def generate(self, cx: int, cy: int):
+        """
+        Function that generates a chunk with its tile map, chests and monsters
+        """
+
+        size, halo = self.chunk_size, self.halo
+
+        # Initial walls of the chunk and its 8 neighbours, cut down to the halo
+        region = np.block([[self.noise(cx + dx, cy + dy) for dx in (-1, 0, 1)] for dy in (-1, 0, 1)])
+        region = region[size - halo:2 * size + halo, size - halo:2 * size + halo]
+
+        # Every iteraction spoils the outer cells of the region, which is why the halo is wide enough
+        for _ in range(self.iterations):
+            region = automaton.step(region, self.rule, COUNT_MODE, border=False)
+
+        grid = region[halo - 2:halo + size + 2, halo - 2:halo + size + 2]
+        tiles = grid[2:-2, 2:-2].copy()
+
+        rng = random.Random(chunk_seed(self.seed, cx, cy))
+        tile_map = tile_chunk(grid, rng)
+        chest_grid = objects.build_chest_grid(tile_map, tiles.ravel(), size, size, rng, allowed=chest_cells(size),
+                                              margins=False)
+        monster_grid = monsters.build_monster_grid(tile_map, chest_grid, size, size, rng)
+
+        return {
+            "tiles": tiles,
+            "tile_map": tile_map,
+            "chest_grid": chest_grid,
+            "monster_grid": monster_grid,
+            "bytes": tiles.nbytes + tile_map.nbytes + sys.getsizeof(chest_grid) + sys.getsizeof(monster_grid),
+        }
+
+
+def chest_cells(size: int, radius: int = RADIUS):
+    """
+    Function that returns the cells of a chunk where chests can go: far enough from the edges that the walls
+    checked around them are all in the chunk, and that the chests of two chunks are more than radius cells apart
+    """
+
+    edge = max(radius // 2 + 1, CHEST_CLEARANCE)
+    allowed = np.zeros((size, size), dtype=bool)
+    allowed[edge:size - edge, edge:size - edge] = True
+
+    return allowed.reshape(-1)
+
+
+def tile_chunk(grid, rng):
+    """
+    Function that builds the tile map of a chunk, like terrain.to_tile_set.
+    The grid holds the walls of the chunk plus 2 cells of its neighbours on every side
+    """
+
+    tile_rng = np.random.default_rng(rng.getrandbits(64))
+
+    # Tiles of the chunk plus 1 cell on every side, so the edge walls know their neighbours
+    counts = automaton.count_walls(grid, 1)[1:-1, 1:-1]
+    tile_grid = autotile.base_tiles(grid[1:-1, 1:-1], counts, tile_rng)
+
+    return autotile.connect_walls(tile_grid, tile_rng)[1:-1, 1:-1].reshape(-1)